@@ -0,0 +1,115 @@
+import os
+import sys
+import shutil
+import zipfile
+import threading
+import tracing
+
+class Archiver(object):
+    """
+    Publishes finished report PDFs from the output folder to an archive folder
+    (e.g. a network share), one report at a time as each is ready.
+
+    Each PDF is hardlinked when the archive is on the same filesystem as the
+    output folder, copied otherwise, and always written under a temporary name
+    first, then renamed into place: the archive never holds a partly written
+    PDF. With zip_bundles, every result sheet's PDFs are also streamed into
+    <archive>/<sheet>.zip, which appears when close() is called.
+
+    publish() may be called from several threads at once.
+    """
+    def __init__(self, output_folder, archive_folder, zip_bundles=False):
+        self.output_folder = output_folder
+        self.archive_folder = archive_folder
+        self.zip_bundles = zip_bundles
+        self.linked = 0
+        self.copied = 0
+        self._can_link = True
+        self._bundles = {}  # result sheet -> (ZipFile, lock, names written)
+        self._bundles_lock = threading.Lock()
+
+    def publish(self, relative_path):
+        """
+        Archives one PDF, given by its path relative to the output folder
+        (e.g. 'WH/XG1_WHP_JaneDoe_Report.pdf'). Returns False if it was
+        already archived (same file), True otherwise. Raises OSError.
+        """
+        with tracing.span('archive', 'archive', sheet=relative_path.split('/')[0], report=relative_path):
+            return self._publish(relative_path)
+
+    def _publish(self, relative_path):
+        parts = relative_path.split('/')
+        src = os.path.join(self.output_folder, *parts)
+        dst = os.path.join(self.archive_folder, *parts)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+        if self.zip_bundles and len(parts) > 1:
+            self._add_to_bundle(parts[0], src, '/'.join(parts[1:]))
+
+        if _same_file(src, dst):
+            return False
+        tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if not self._link(src, tmp_path):
+                shutil.copy2(src, tmp_path)
+                self.copied += 1
+            os.replace(tmp_path, dst)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def _link(self, src, tmp_path):
+        """Hardlinks src to tmp_path. False (and no more attempts) if links can't be made."""
+        if not self._can_link:
+            return False
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            # Another filesystem, or one without hardlinks (e.g. a network share)
+            self._can_link = False
+            return False
+        self.linked += 1
+        return True
+
+    def _add_to_bundle(self, sheet_name, src, name):
+        with self._bundles_lock:
+            bundle = self._bundles.get(sheet_name)
+            if bundle is None:
+                zip_path = os.path.join(self.archive_folder, f"{sheet_name}.zip")
+                # PDFs are compressed already: store them as they are
+                bundle = (zipfile.ZipFile(f"{zip_path}.tmp", 'w', zipfile.ZIP_STORED), threading.Lock(), set())
+                self._bundles[sheet_name] = bundle
+        zip_file, lock, names = bundle
+        with lock:
+            if name in names:
+                return # Report built twice in one run (same output file)
+            names.add(name)
+            zip_file.write(src, name)
+
+    def close(self, discard=False):
+        """Finishes the zip bundles, renaming each into place (or deleting them, with discard)."""
+        with self._bundles_lock:
+            bundles, self._bundles = self._bundles, {}
+        for sheet_name, (zip_file, _, names) in bundles.items():
+            zip_path = os.path.join(self.archive_folder, f"{sheet_name}.zip")
+            try:
+                zip_file.close()
+                if discard:
+                    os.remove(f"{zip_path}.tmp")
+                    continue
+                os.replace(f"{zip_path}.tmp", zip_path)
+                print(f"INFO: Wrote {zip_path} ({len(names)} reports).")
+            except OSError as e:
+                print(f"  > WARNING: Could not write {zip_path}. {e}", file=sys.stderr)
+
+def _same_file(src, dst):
+    """True if dst already is src: the same hardlinked file, or a copy of the same size and time."""
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
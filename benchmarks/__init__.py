@@ -0,0 +1 @@
+"""Performance benchmarks for the report generator. Run modules with `python -m benchmarks.<name>`."""
@@ -0,0 +1,92 @@
+"""
+Measures the per-report speedup of compiling against a precompiled format.
+
+Compiles the same sample record several times per template, once with
+config.USE_PRECOMPILED_FORMAT off and once on, and prints the average
+wall time per report. Needs pdflatex (and mylatexformat) on the PATH.
+
+    python -m benchmarks.format_speedup --reports 5
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project modules importable when run as `python -m benchmarks.format_speedup`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import report_compiler
+import report_rules
+
+def sample_record(template_path):
+    """A record with sample text fields and a Ct value for every pathogen the template reads."""
+    with open(template_path, 'r') as f:
+        names = report_rules.value_names(f.read())
+    record = {name: 28.5 for name in sorted(names - set(config.TEXT_FIELDS))}
+    record.update({
+        'PatientFirstName': 'Jane', 'PatientLastName': 'Doe', 'PatientDOB': '01/01/1980',
+        'PatientSex': 'F', 'TestID': 'XG-BENCH', 'Barcode': '100000',
+        'PhysicianName': 'Dr. Bench', 'PhysicianSpecialty': 'Benchmark Clinic',
+        'DateCollected': '01/02/2025', 'DateReceived': '01/03/2025',
+        'ReportDate': '01/04/2025', 'Panel': 'BENCH', 'SampleType': 'Swab',
+    })
+    return record
+
+def time_reports(template_path, output_folder, reports, use_format):
+    """Average seconds per report, or None if a compile failed."""
+    config.USE_PRECOMPILED_FORMAT = use_format
+    report_compiler._aux_seeds.clear()
+    # Build the format up front so its one-off cost isn't counted per report
+    report_compiler._template_format(template_path)
+
+    record = sample_record(template_path)
+    start = time.perf_counter()
+    for i in range(reports):
+        data = dict(record, TestID=f"XG-BENCH{i}")
+        if not report_compiler.compile_single_report(data, template_path, output_folder, 'BENCH', 'bench'):
+            return None
+    return (time.perf_counter() - start) / reports
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-report speedup from precompiled template formats")
+    parser.add_argument('--reports', type=int, default=5, help="Reports compiled per template and mode.")
+    parser.add_argument('--templates', nargs='*', help="Template names (default: every template).")
+    args = parser.parse_args()
+
+    if shutil.which('pdflatex') is None:
+        print("ERROR: pdflatex was not found on the PATH.", file=sys.stderr)
+        return
+
+    names = args.templates or sorted(
+        os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(config.TEMPLATE_DIR, '*.tex'))
+    )
+
+    rows = []
+    # Reports land in <work_dir>/bench/ (pdflatex itself runs in a scratch folder)
+    work_dir = tempfile.mkdtemp(prefix='xg-bench-')
+    try:
+        for name in names:
+            template_path = os.path.join(config.TEMPLATE_DIR, f"{name}.tex")
+            plain = time_reports(template_path, work_dir, args.reports, use_format=False)
+            with_format = time_reports(template_path, work_dir, args.reports, use_format=True)
+            rows.append((name, plain, with_format))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("=============================================")
+    print("   Precompiled Format Benchmark (sec/report)")
+    print("=============================================")
+    print(f"  {'Template':<20} {'Plain':>8} {'Format':>8} {'Speedup':>8}")
+    for name, plain, with_format in rows:
+        if plain is None or with_format is None:
+            print(f"  {name:<20} {'failed':>8}")
+            continue
+        print(f"  {name:<20} {plain:>8.2f} {with_format:>8.2f} {plain / with_format:>7.2f}x")
+    print("=============================================")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Times every stage of a full run (loading, joining, validation, rendering,
+pdflatex, publishing, archiving) on synthetic workbooks of several sizes.
+
+By default pdflatex is replaced by benchmarks/stub_pdflatex.py with a fixed
+latency per run, which measures the report generator's own overhead and
+needs no TeX installation. --real-tex uses the pdflatex on the PATH.
+
+    python -m benchmarks.pipeline_stages --sizes 100 1000 --latency 0.05
+    python -m benchmarks.pipeline_stages --sizes 100 --real-tex
+
+Each run's log goes to <work>/<size>/run.log and its Chrome trace to
+<work>/<size>/trace.json (see tracing.py); pass --keep to look at them.
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Make the project modules importable when run as `python -m benchmarks.pipeline_stages`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import pipeline
+import tracing
+from benchmarks import stub_pdflatex, synthetic
+
+# Stages shown in the table, in pipeline order (span names, see tracing.py)
+STAGES = [
+    ('load', ['load_demographics', 'load_results_workbook']),
+    ('join', ['join']),
+    ('validate', ['validate']),
+    ('render', ['render_valsets']),
+    ('write', ['write_tex']),
+    ('pdflatex', ['pdflatex', 'pdflatex draft']),
+    ('split', ['split batch']),
+    ('publish', ['publish']),
+    ('archive', ['archive']),
+]
+
+def run_size(work_dir, patients, jobs, batch_size):
+    """Runs the whole pipeline once. Returns (summary, seconds, stage totals)."""
+    inputs_dir = os.path.join(work_dir, 'inputs')
+    demographics_path, results_path = synthetic.write_inputs(inputs_dir, patients)
+
+    log_path = os.path.join(work_dir, 'run.log')
+    tracing.start()
+    started = time.perf_counter()
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            summary = pipeline.run_pipeline(
+                demographics_path, results_path,
+                output_folder=os.path.join(work_dir, 'output'),
+                use_cache=False,
+                jobs=jobs,
+                batch_size=batch_size,
+                rebuild=True,
+                archive_folder=os.path.join(work_dir, 'archive'),
+            )
+    finally:
+        seconds = time.perf_counter() - started
+        spans = tracing.collect()
+        tracing.write_chrome_trace(spans, os.path.join(work_dir, 'trace.json'))
+    return summary, seconds, tracing.stage_totals(spans)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage timings of full runs on synthetic workbooks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=synthetic.SIZES[:2],
+                        help=f"Patient counts to run (default: 100 1000; the full set is {' '.join(map(str, synthetic.SIZES))}).")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per stub pdflatex run (default: 0.05).")
+    parser.add_argument('--real-tex', action='store_true', help="Use the real pdflatex on the PATH instead of the stub.")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Parallel pdflatex jobs (default: one per CPU core).")
+    parser.add_argument('-b', '--batch-size', type=int, default=None, help="Reports per pdflatex job (default: 1).")
+    parser.add_argument('--keep', action='store_true', help="Keep the work folder (inputs, outputs, logs, traces).")
+    args = parser.parse_args()
+
+    work_root = tempfile.mkdtemp(prefix='xg-bench-')
+    # Formats built by the stub (or for this benchmark) stay out of the real cache
+    config.CACHE_DIR = os.path.join(work_root, 'cache')
+    config.FORMAT_DIR = os.path.join(config.CACHE_DIR, 'formats')
+    if args.real_tex:
+        if shutil.which('pdflatex') is None:
+            print("ERROR: pdflatex was not found on the PATH.", file=sys.stderr)
+            return
+        engine = "pdflatex"
+    else:
+        bin_dir = os.path.join(work_root, 'bin')
+        stub_pdflatex.install(bin_dir, args.latency)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        engine = f"stub pdflatex, {args.latency:g}s per run"
+
+    rows = []
+    try:
+        for patients in args.sizes:
+            print(f"INFO: Running {patients} patients ({engine})...")
+            work_dir = os.path.join(work_root, str(patients))
+            rows.append((patients,) + run_size(work_dir, patients, args.jobs, args.batch_size))
+    finally:
+        if args.keep:
+            print(f"INFO: Work folder kept: {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print("=============================================")
+    print(f"   Pipeline Stage Benchmark ({engine})")
+    print("   Stage columns are busy seconds summed over all threads")
+    print("=============================================")
+    header = f"  {'Patients':>8} {'Reports':>8} {'Wall s':>8} {'Rep/min':>8}"
+    header += ''.join(f" {label:>9}" for label, _ in STAGES)
+    print(header)
+    for patients, summary, seconds, totals in rows:
+        if summary is None:
+            print(f"  {patients:>8} {'failed to load':>17}")
+            continue
+        line = f"  {patients:>8} {summary.success:>8} {seconds:>8.2f} {60 * summary.success / seconds:>8.0f}"
+        for _, names in STAGES:
+            line += f" {sum(totals.get(name, (0, 0.0))[1] for name in names):>9.2f}"
+        print(line)
+    print("=============================================")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+A stand-in for pdflatex, for measuring the orchestration overhead of a run
+(loading, rendering, process handling, publishing) on machines without TeX.
+
+It takes the command lines report_compiler uses (-jobname, -output-directory,
+-draftmode, -fmt, -ini, --version), waits XG_STUB_LATENCY seconds (default 0)
+to stand in for typesetting, and writes the .log, .aux and (unless -draftmode)
+a blank .pdf. Batch documents get two pages per report and the page-count
+lines compile_report_batch() reads, so batches split as with real TeX.
+
+install() puts a `pdflatex` launcher for it in a folder, to prepend to PATH.
+"""
+import os
+import sys
+import time
+
+LATENCY_VARIABLE = 'XG_STUB_LATENCY'
+PAGES_PER_REPORT = 2
+
+def blank_pdf(pages):
+    """A minimal valid PDF with the given number of blank pages."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            ' '.join(f"{3 + n} 0 R" for n in range(pages)), pages)).encode('ascii'),
+    ]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"] * pages
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_at = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(pdf)
+
+def run(args):
+    if '--version' in args:
+        print("pdfTeX 3.141592653 (benchmark stub)")
+        return 0
+
+    jobname = None
+    output_dir = '.'
+    draft = False
+    for arg in args:
+        if arg.startswith('-jobname='):
+            jobname = arg.split('=', 1)[1]
+        elif arg.startswith('-output-directory='):
+            output_dir = arg.split('=', 1)[1]
+        elif arg == '-draftmode':
+            draft = True
+
+    if '-ini' in args:
+        # Format dump: write something where the format would go
+        with open(f"{jobname}.fmt", 'w') as f:
+            f.write('benchmark stub format\n')
+        return 0
+
+    tex_path = [arg for arg in args if not arg.startswith('-')][-1]
+    jobname = jobname or os.path.splitext(os.path.basename(tex_path))[0]
+    with open(tex_path, 'r', errors='replace') as f:
+        source = f.read()
+
+    time.sleep(float(os.environ.get(LATENCY_VARIABLE) or 0))
+
+    reports = source.count('\\XGEndReport{')
+    for n in range(1, reports + 1):
+        print(f"XGREPORTPAGES:{n}:{PAGES_PER_REPORT}")
+    with open(os.path.join(output_dir, f"{jobname}.log"), 'w') as f:
+        f.write("This is the benchmark stub pdflatex.\n")
+    with open(os.path.join(output_dir, f"{jobname}.aux"), 'w') as f:
+        f.write("\\relax\n\\newlabel{LastPage}{{}{%d}}\n" % PAGES_PER_REPORT)
+    if not draft:
+        with open(os.path.join(output_dir, f"{jobname}.pdf"), 'wb') as f:
+            f.write(blank_pdf(PAGES_PER_REPORT * max(1, reports)))
+    return 0
+
+def install(bin_dir, latency=0.0):
+    """
+    Writes a `pdflatex` launcher for this stub into bin_dir and sets the
+    latency (seconds per run). Prepend bin_dir to PATH to use it.
+    """
+    if os.name == 'nt':
+        # subprocess only finds .exe files on PATH there, not a .bat launcher
+        raise OSError("the pdflatex stub needs a POSIX system")
+    os.makedirs(bin_dir, exist_ok=True)
+    launcher = os.path.join(bin_dir, 'pdflatex')
+    with open(launcher, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+    os.chmod(launcher, 0o755)
+    os.environ[LATENCY_VARIABLE] = str(latency)
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
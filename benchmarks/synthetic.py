@@ -0,0 +1,120 @@
+"""
+Writes synthetic input workbooks for the benchmarks: a demographics sheet
+with the columns load_demographics() renames, and a lab results workbook
+with a Crosswalk sheet and one result sheet per template family in the
+3-row header layout, with a pathogen column for every value its templates read.
+
+    python -m benchmarks.synthetic --patients 1000 --out /tmp/xg-inputs
+"""
+import argparse
+import datetime
+import glob
+import os
+import random
+import sys
+
+# Make the project modules importable when run as `python -m benchmarks.synthetic`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+import config
+import report_rules
+
+SIZES = [100, 1000, 10000, 50000]
+
+FIRST_NAMES = ['Jane', 'Maria', 'Aisha', 'Mei', 'Olga', "Siobhan", 'Ana-Lucia', 'Priya', 'Fatima', 'Emma']
+LAST_NAMES = ['Doe', "O'Brien", 'Garcia', 'Nguyen', 'Smith & Sons', 'Kowalski', 'Li', 'Müller', 'Patel', 'Johnson']
+PHYSICIANS = ['Dr. Adams', 'Dr. Baker', 'Dr. Chen', 'Dr. Diaz', 'Dr. Evans', 'Dr. Fox']
+FACILITIES = ['Northside Clinic', 'Women\'s Health #2', 'Central Lab', 'Urgent Care 50%', 'Riverside OB/GYN']
+SAMPLE_TYPES = ['Swab', 'Urine', 'Vaginal Swab']
+
+def template_routes(template_dir=None):
+    """
+    One Crosswalk route per template: (panel, template name, result sheet,
+    pathogen names). Templates named alike ('WH template 1', 'WH template 2')
+    share a result sheet, as in the production workbook.
+    """
+    template_dir = template_dir or config.TEMPLATE_DIR
+    routes = []
+    for path in sorted(glob.glob(os.path.join(template_dir, '*.tex'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, 'r') as f:
+            names = report_rules.value_names(f.read())
+        pathogens = sorted(names - set(config.TEXT_FIELDS))
+        routes.append((f"BENCH-{name.upper().replace(' ', '-')}", name, name.split()[0], pathogens))
+    return routes
+
+def _ct_value(rng):
+    """A Ct cell: mostly not detected, some detected, a few not tested or text."""
+    r = rng.random()
+    if r < 0.55:
+        return None
+    if r < 0.60:
+        return -1
+    if r < 0.62:
+        return 'Pending'
+    return round(rng.uniform(12, 40), 2)
+
+def write_inputs(folder, patients, seed=0, template_dir=None):
+    """
+    Writes demographics.xlsx and results.xlsx for the given number of patients
+    into folder. Returns (demographics_path, results_path).
+    """
+    rng = random.Random(seed)
+    routes = template_routes(template_dir)
+    os.makedirs(folder, exist_ok=True)
+
+    # Pathogen columns per result sheet (union over the templates using it)
+    sheet_columns = {}
+    for _, _, sheet_name, pathogens in routes:
+        columns = sheet_columns.setdefault(sheet_name, [])
+        columns.extend(p for p in pathogens if p not in columns)
+
+    patient_routes = [routes[rng.randrange(len(routes))] for _ in range(patients)]
+
+    demographics_path = os.path.join(folder, 'demographics.xlsx')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Patients')
+    sheet.append(['First Name', 'Last Name', 'DOB', 'Gender', 'Physician', 'Collection Date', 'FACILITIES',
+                  'Received Date', 'XG ID', 'Sample Type', 'Barcode', 'Panel'])
+    collected = datetime.datetime(2025, 1, 6)
+    for i, (panel, _, _, _) in enumerate(patient_routes):
+        sheet.append([
+            rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+            datetime.datetime(1950, 1, 1) + datetime.timedelta(days=rng.randrange(25000)),
+            'F', rng.choice(PHYSICIANS), collected, rng.choice(FACILITIES),
+            collected + datetime.timedelta(days=1), f"XG{100000 + i}", rng.choice(SAMPLE_TYPES),
+            2000000 + i, panel,
+        ])
+    workbook.save(demographics_path)
+
+    results_path = os.path.join(folder, 'results.xlsx')
+    workbook = openpyxl.Workbook(write_only=True)
+    crosswalk = workbook.create_sheet(config.CROSSWALK_SHEET_NAME)
+    crosswalk.append(['Panel', 'Result Template', 'Result Sheet'])
+    for panel, template_name, sheet_name, _ in routes:
+        crosswalk.append([panel, template_name, sheet_name])
+
+    for sheet_name, columns in sheet_columns.items():
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([f"{sheet_name} results"])
+        sheet.append([None, None, None] + columns)
+        sheet.append([None, 'Barcode', 'Panel'] + ['Ct'] * len(columns))
+        for i, (panel, _, patient_sheet, _) in enumerate(patient_routes):
+            if patient_sheet == sheet_name:
+                sheet.append([i + 1, 2000000 + i, panel] + [_ct_value(rng) for _ in columns])
+    workbook.save(results_path)
+
+    return demographics_path, results_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes synthetic demographics and results workbooks")
+    parser.add_argument('--patients', type=int, default=1000, help="Number of patients.")
+    parser.add_argument('--out', required=True, help="Folder for demographics.xlsx and results.xlsx.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (same seed, same workbooks).")
+    args = parser.parse_args()
+    demographics_path, results_path = write_inputs(args.out, args.patients, args.seed)
+    print(f"Wrote {demographics_path} and {results_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import hashlib
+import config
+
+# Bump this whenever the report inputs hashed below change meaning.
+MANIFEST_VERSION = 1
+
+class BuildManifest(object):
+    """
+    Records, per report, a hash of what it was built from (template text and
+    rendered \\ValSet block) and the PDF it produced. A report is only compiled
+    again when that hash changes or its PDF is missing or was replaced.
+
+    Each finished report is appended to a journal file right away, so a run
+    that stops half way resumes from the last compiled report. save() folds the
+    journal back into the manifest.
+    """
+    def __init__(self, output_folder):
+        self.path = os.path.join(output_folder, f"{config.BUILD_MANIFEST_NAME}.json")
+        self.journal_path = os.path.join(output_folder, f"{config.BUILD_MANIFEST_NAME}.journal")
+        self.output_folder = output_folder
+        self.entries = {}
+        self._journal = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest.get('reports', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"  > WARNING: Could not read build manifest, rebuilding all reports. {e}", file=sys.stderr)
+
+        # Replay reports finished by an interrupted run
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break # Last line cut short by the interruption
+                    if entry.get('version') == MANIFEST_VERSION:
+                        self.entries[entry['report']] = entry['build']
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"  > WARNING: Could not read build journal. {e}", file=sys.stderr)
+
+    def _pdf_path(self, report_key):
+        return os.path.join(self.output_folder, *report_key.split('/'))
+
+    def is_current(self, report_key, input_hash):
+        """
+        True if the report was built from input_hash and its PDF is unchanged.
+        A PDF with the recorded size but a new timestamp (e.g. copied back
+        from a backup) is compared by its SHA-256 instead of being rebuilt.
+        """
+        build = self.entries.get(report_key)
+        if build is None or build.get('input') != input_hash:
+            return False
+        pdf_path = self._pdf_path(report_key)
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            return False
+        if build.get('pdf_size') != stat.st_size:
+            return False
+        if build.get('pdf_mtime_ns') == stat.st_mtime_ns:
+            return True
+        try:
+            if _file_sha256(pdf_path) != build.get('pdf_sha256'):
+                return False
+        except OSError:
+            return False
+        build['pdf_mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def record(self, report_key, input_hash):
+        """Records a freshly compiled report and appends it to the journal."""
+        pdf_path = self._pdf_path(report_key)
+        try:
+            stat = os.stat(pdf_path)
+            pdf_hash = _file_sha256(pdf_path)
+        except OSError:
+            self.entries.pop(report_key, None)
+            return
+        build = {
+            'input': input_hash,
+            'pdf_sha256': pdf_hash,
+            'pdf_size': stat.st_size,
+            'pdf_mtime_ns': stat.st_mtime_ns,
+        }
+        self.entries[report_key] = build
+        try:
+            if self._journal is None:
+                os.makedirs(self.output_folder, exist_ok=True)
+                self._journal = open(self.journal_path, 'a')
+            self._journal.write(json.dumps({'version': MANIFEST_VERSION, 'report': report_key, 'build': build}) + '\n')
+            self._journal.flush()
+        except OSError as e:
+            print(f"  > WARNING: Could not write build journal. {e}", file=sys.stderr)
+
+    def forget(self, report_key):
+        """Drops a report, e.g. when its compile failed."""
+        self.entries.pop(report_key, None)
+
+    def save(self):
+        """Writes the manifest atomically and removes the journal."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        try:
+            os.makedirs(self.output_folder, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'reports': self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+        except OSError as e:
+            print(f"  > WARNING: Could not save build manifest. {e}", file=sys.stderr)
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
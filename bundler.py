@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import pandas as pd
+import config
+import report_compiler
+import tracing
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.errors import PyPdfError
+except ImportError:
+    PdfReader = PdfWriter = None
+
+class Bundler(object):
+    """
+    Concatenates finished report PDFs into one PDF per physician or facility
+    (config.BUNDLE_FIELDS), with a bookmark per report, for delivery as a
+    single packet. Pages are copied as they are: nothing is typeset again.
+
+    plan() is given every report of the run up front. As each report settles
+    (compiled, up to date or failed), settle() returns the groups that have
+    no reports left outstanding, and write() builds each such bundle:
+    <bundle_folder>/<by>/<group>.pdf, in the order of the demographics file.
+    """
+    def __init__(self, output_folder, bundle_folder, group_by):
+        self.output_folder = output_folder
+        self.bundle_folder = bundle_folder
+        self.group_by = list(group_by)
+        self.written = 0
+        self._groups = {}       # (by, group) -> [(report key, bookmark title)] in run order
+        self._outstanding = {}  # (by, group) -> reports not settled yet
+        self._report_groups = {}  # report key -> its groups, once per report planned
+        self._produced = set()
+        self._lock = threading.Lock()
+
+    def plan(self, reports):
+        """Registers every report of the run: (report key, record dict, panel) in run order."""
+        for key, record_dict, panel in reports:
+            title = _bookmark_title(record_dict, panel)
+            groups = []
+            for by in self.group_by:
+                group = (by, _group_name(record_dict.get(config.BUNDLE_FIELDS[by])))
+                self._groups.setdefault(group, []).append((key, title))
+                self._outstanding[group] = self._outstanding.get(group, 0) + 1
+                groups.append(group)
+            self._report_groups.setdefault(key, []).append(groups)
+
+    def settle(self, report_key, produced):
+        """Notes that a report is done with. Returns the groups now complete."""
+        complete = []
+        with self._lock:
+            if produced:
+                self._produced.add(report_key)
+            planned = self._report_groups.get(report_key)
+            if not planned:
+                return complete
+            for group in planned.pop(0):
+                self._outstanding[group] -= 1
+                if self._outstanding[group] == 0:
+                    complete.append(group)
+        return complete
+
+    def write(self, group):
+        """
+        Writes one group's bundle, leaving out reports whose PDF can't be read.
+        Returns its path, or None if it had no PDFs. Raises OSError if the
+        bundle can't be written.
+        """
+        by, name = group
+        reports = []
+        seen = set()
+        with self._lock:
+            for key, title in self._groups[group]:
+                if key in self._produced and key not in seen:
+                    seen.add(key)
+                    reports.append((key, title))
+        if not reports:
+            return None
+
+        bundle_path = os.path.join(self.bundle_folder, by, f"{name}.pdf")
+        pdf_paths = [os.path.join(self.output_folder, *key.split('/')) for key, _ in reports]
+
+        with tracing.span('bundle', 'bundle', group=f"{by}/{name}", reports=len(reports)):
+            os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+            writer = PdfWriter()
+            appended = 0
+            for pdf_path, (_, title) in zip(pdf_paths, reports):
+                try:
+                    writer.append(PdfReader(pdf_path), outline_item=title, import_outline=False)
+                    appended += 1
+                except PyPdfError as e:
+                    print(f"  > WARNING: Left {os.path.basename(pdf_path)} out of bundle {by}/{name}: not a readable PDF ({e}).", file=sys.stderr)
+                except OSError as e:
+                    print(f"  > WARNING: Left {os.path.basename(pdf_path)} out of bundle {by}/{name}: could not read it ({e}).", file=sys.stderr)
+            if not appended:
+                writer.close()
+                return None
+            writer.page_mode = '/UseOutlines'
+            tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    writer.write(f)
+                os.replace(tmp_path, bundle_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                writer.close()
+        self.written += 1
+        return bundle_path
+
+def available():
+    """True if bundles can be written (they need pypdf)."""
+    if PdfWriter is None:
+        print("  > WARNING: Bundles need the pypdf package; no bundles will be written.", file=sys.stderr)
+        return False
+    return True
+
+def _group_name(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)) or not str(value).strip():
+        return 'Unassigned'
+    return report_compiler._sanitize_for_filename(str(value).strip()) or 'Unassigned'
+
+def _bookmark_title(record_dict, panel):
+    """'Doe, Jane - XG12345 (WHP)'"""
+    def text(field):
+        value = record_dict.get(field)
+        return '' if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value).strip()
+
+    name = ', '.join(part for part in (text('PatientLastName'), text('PatientFirstName')) if part)
+    return f"{name or 'Unknown patient'} - {text('TestID') or '?'} ({panel})"
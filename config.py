@@ -9,6 +9,16 @@ DATA_DIR = os.path.join(PROJECT_DIR, 'data')
 TEMPLATE_DIR = os.path.join(PROJECT_DIR, 'templates')
 OUTPUT_DIR = os.path.join(PROJECT_DIR, 'output')
 ASSETS_DIR = os.path.join(PROJECT_DIR, 'assets') # Path for images
+CACHE_DIR = os.path.join(PROJECT_DIR, 'cache') # Parsed Excel files, reused across runs
+FORMAT_DIR = os.path.join(CACHE_DIR, 'formats') # Precompiled LaTeX formats, one per template preamble
+LOG_DIR = os.path.join(PROJECT_DIR, 'logs') # Full GUI log (gui.log, rotated)
+# Where pdflatex writes its .tex/.aux/.log files while compiling. None uses
+# /dev/shm (tmpfs) when available, else the system temp folder.
+SCRATCH_DIR = None
+
+# --- Parsed-File Cache ---
+# Total size the cache may grow to before the least recently used entries are evicted.
+CACHE_MAX_BYTES = 512 * 1024 * 1024
 
 # --- File Names ---
 # REMOVED: DEMOGRAPHICS_FILE - This will now be a command-line argument.
@@ -46,3 +56,116 @@ DATE_FIELDS = [
     'DateReceived',
     'ReportDate'
 ]
+
+# --- Result Sheets ---
+# Keep parsed result sheets in compact columns (float64 Ct values, categorical
+# repeated text) instead of one Python object per cell. See data_handler.ResultSheet.
+COMPACT_RESULT_SHEETS = True
+
+# --- Result Rules ---
+# Compute each lab result's Detected/Not detected text, XA value and level tag in
+# Python (report_rules.py) and pass them to the template, instead of having
+# LaTeX work them out from the Ct value on every run.
+PRECOMPUTE_RULES = True
+
+# Before compiling with a template, typeset a set of sample values with both the
+# precomputed and the template's own rules (report_rules.check_templates()) and
+# only use the precomputed ones if they print the same. Checked once per template.
+CHECK_PRECOMPUTED_RULES = True
+
+# --- Pre-Batch Validation ---
+# Written to OUTPUT_DIR as <name>.csv (one row per problem) and <name>.json (grouped by barcode).
+VALIDATION_REPORT_NAME = 'validation_report'
+
+# --- Incremental Builds ---
+# Written to OUTPUT_DIR as <name>.json: what each report PDF was built from, so
+# a rerun only compiles reports that changed. <name>.journal holds the reports
+# finished by a run that hasn't completed yet (an interrupted run resumes from it).
+BUILD_MANIFEST_NAME = 'build_manifest'
+
+# --- Sharding ---
+# A shard of a split run (main.py --shard K/N) writes <SHARD_SUMMARY_NAME>.json
+# to its output folder; sharding.py merges them into <SHARD_MERGE_NAME>.json.
+SHARD_SUMMARY_NAME = 'shard_summary'
+SHARD_MERGE_NAME = 'shard_merge'
+
+# --- Compilation ---
+# Number of reports compiled at once (concurrent pdflatex processes).
+# None uses one per CPU core; the --jobs option / GUI setting overrides it.
+COMPILE_JOBS = None
+
+# pdflatex is rerun only while the .aux file changes or the log asks for it
+# (lastpage / longtable references), up to this many runs per report.
+MAX_LATEX_RUNS = 3
+
+# Wall-clock limit in seconds for one report's pdflatex runs. A job still
+# running then (e.g. a runaway expansion) is killed with its process group.
+# A batch job gets this much per report in it. None disables the limit.
+COMPILE_TIMEOUT = 60
+
+# Times a timed-out report is compiled again at the end of the batch.
+COMPILE_RETRIES = 1
+
+# A first run that can't be the last (no .aux to start from) uses -draftmode:
+# it only writes the .aux, and the PDF comes from the final run.
+DRAFT_FIRST_PASS = True
+
+# Compile reports against a format dumped once per template preamble (needs the
+# mylatexformat package). Falls back to a normal run if the format can't be built.
+USE_PRECOMPILED_FORMAT = True
+
+# Reports of the same template typeset in one pdflatex job, then split into
+# per-report PDFs (needs pypdf). 1 compiles every report in its own job.
+# The job's time limit is COMPILE_TIMEOUT times the number of reports in it.
+COMPILE_BATCH_SIZE = 1
+
+# --- Pipeline ---
+# Records validated and rendered together (one columnar pass) before they are
+# handed on to the compile stage.
+PIPELINE_CHUNK_SIZE = 64
+
+# Reports each stage may hold waiting for the next one, per compile job. Bounds
+# how far loading and rendering run ahead of pdflatex.
+PIPELINE_QUEUE_DEPTH = 4
+
+# --- Archiving ---
+# Threads publishing finished PDFs to the archive folder (mostly waiting on
+# the destination, e.g. a network share).
+ARCHIVE_WORKERS = 4
+
+# Also stream each result sheet's PDFs into <archive>/<sheet>.zip.
+ARCHIVE_ZIP = False
+
+# --- GUI Log ---
+# The log window is refreshed every GUI_LOG_FLUSH_MS milliseconds with the
+# lines printed since, and keeps the last GUI_LOG_MAX_LINES lines. The full
+# log goes to LOG_DIR/gui.log, rotated at LOG_FILE_MAX_BYTES with
+# LOG_FILE_BACKUPS older files kept.
+GUI_LOG_FLUSH_MS = 100
+GUI_LOG_MAX_LINES = 5000
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+# --- Profiling ---
+# With --profile (or "Profile Run" in the GUI) the run's stage timings are
+# written to OUTPUT_DIR as <name>.json, a Chrome trace (chrome://tracing or
+# https://ui.perfetto.dev), and summarized at the end of the run.
+PROFILE_TRACE_NAME = 'trace'
+
+# --- Watch Folder ---
+# watch_folder.py checks its inbox every WATCH_INTERVAL seconds, and takes a
+# demographics/results pair once neither file has changed for
+# WATCH_SETTLE_SECONDS (so files still being copied in are left alone).
+WATCH_INTERVAL = 5
+WATCH_SETTLE_SECONDS = 10
+
+# --- Bundles ---
+# Concatenate the finished PDFs into one bundle per physician and/or facility
+# (keys of BUNDLE_FIELDS, e.g. ['physician']), with a bookmark per report.
+# Written to <output>/<BUNDLE_DIR_NAME>/<physician|facility>/<name>.pdf.
+BUNDLE_BY = []
+BUNDLE_DIR_NAME = 'bundles'
+BUNDLE_FIELDS = {
+    'physician': 'PhysicianName',
+    'facility': 'PhysicianSpecialty',
+}
@@ -1,7 +1,17 @@
 import pandas as pd
+import numpy as np
+import openpyxl
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
 import sys
+import os
+import hashlib
+import pickle
 from datetime import datetime
 import config # Import our config file
+import tracing
+
+# Bump this whenever the parsing logic changes, so stale cache entries are ignored.
+LOADER_VERSION = 2
 
 def _deduplicate_columns(columns):
     """Ensures all column names are unique by appending _1, _2, etc."""
@@ -22,11 +32,99 @@ def _deduplicate_columns(columns):
             new_columns.append(new_name)
     return new_columns
 
-def load_demographics(demographics_path):
-    """Loads the patient demographics file."""
+# --- Parsed-File Cache ---
+# Parsed DataFrames are pickled (pandas keeps each column block as a numpy array)
+# into config.CACHE_DIR, keyed by the source file's content hash, size, mtime
+# and LOADER_VERSION. A rerun against the same files skips Excel parsing.
+
+def _cache_path(source_path, kind):
+    """Returns the cache file path for a source file, or None if it can't be hashed."""
+    try:
+        stat = os.stat(source_path)
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    digest.update(f"|{stat.st_size}|{stat.st_mtime_ns}|{LOADER_VERSION}".encode())
+    return os.path.join(config.CACHE_DIR, f"{kind}-{digest.hexdigest()}.pkl")
+
+def _cache_get(cache_path):
+    """Loads a cached entry, or returns None on a miss or unreadable entry."""
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            payload = pickle.load(f)
+        # Refresh the access time so eviction drops the least recently used entries
+        os.utime(cache_path)
+        return payload
+    except Exception:
+        return None
+
+def _cache_put(cache_path, payload):
+    """Writes an entry atomically, then trims the cache to config.CACHE_MAX_BYTES."""
+    if cache_path is None:
+        return
+    try:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        _evict_cache(config.CACHE_MAX_BYTES)
+    except Exception as e:
+        print(f"  > WARNING: Could not write parsed-file cache. {e}", file=sys.stderr)
+
+def _evict_cache(max_bytes):
+    """Deletes the least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(config.CACHE_DIR):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(config.CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def clear_cache():
+    """Removes every parsed-file cache entry. Returns the number of files deleted."""
+    if not os.path.isdir(config.CACHE_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(config.CACHE_DIR):
+        try:
+            os.remove(os.path.join(config.CACHE_DIR, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+def load_demographics(demographics_path, use_cache=True):
+    """Loads the patient demographics file (from the parsed-file cache when possible)."""
     print(f"--- Loading Demographics from {demographics_path} ---")
+    cache_path = _cache_path(demographics_path, 'demographics') if use_cache else None
+    cached = _cache_get(cache_path)
+    if cached is not None:
+        print("  > Using cached copy (file unchanged since last parse)")
+        return cached
+
     try:
-        df = pd.read_excel(demographics_path)
+        with tracing.span('read_demographics', 'load'):
+            df = pd.read_excel(demographics_path)
 
         # Define the column mapping
         column_rename_map = {
@@ -45,6 +143,7 @@ def load_demographics(demographics_path):
         # Rename the columns
         df.rename(columns=column_rename_map, inplace=True)
 
+        _cache_put(cache_path, df)
         return df
     except FileNotFoundError:
         print(f"ERROR: Patient demographics file not found at {demographics_path}", file=sys.stderr)
@@ -53,100 +152,430 @@ def load_demographics(demographics_path):
         print(f"ERROR: Failed to read demographics file. {e}", file=sys.stderr)
         return None
 
-def load_crosswalk(results_path):
-    """Loads the Crosswalk sheet from the lab results file."""
-    print(f"--- Loading Crosswalk from {results_path} ---")
+# Strings pandas treats as missing when it parses an Excel sheet. The streaming
+# loader applies the same rule so its frames match what pd.read_excel produced.
+_NA_TOKENS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+    'n/a', 'nan', 'null'
+}
+
+def _convert_cell(cell):
+    """Converts an openpyxl cell the same way pandas' Excel reader does."""
+    value = cell.value
+    if value is None:
+        return np.nan
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        # Whole numbers come back as int (30.0 -> 30), like pandas
+        as_int = int(value)
+        return as_int if as_int == value else float(value)
+    if isinstance(value, str) and value in _NA_TOKENS:
+        return np.nan
+    return value
+
+def _row_width(row):
+    """Length of a converted row once trailing empty cells are trimmed."""
+    width = len(row)
+    while width and _is_blank(row[width - 1]):
+        width -= 1
+    return width
+
+def _is_blank(value):
+    return isinstance(value, float) and np.isnan(value)
+
+def _read_crosswalk_sheet(sheet):
+    """Reads the Crosswalk sheet (header on row 1) and indexes it by 'Panel'."""
+    rows = [[_convert_cell(c) for c in row] for row in sheet.iter_rows()]
+    while rows and _row_width(rows[-1]) == 0:
+        rows.pop()
+    if not rows:
+        raise KeyError('Panel')
+
+    width = max(_row_width(r) for r in rows)
+    rows = [r[:width] + [np.nan] * (width - len(r)) for r in rows]
+    header = [
+        h if not _is_blank(h) else f"Unnamed: {i}"
+        for i, h in enumerate(rows[0])
+    ]
+    crosswalk_df = pd.DataFrame(rows[1:], columns=header, dtype=object).infer_objects()
+    crosswalk_df.set_index('Panel', inplace=True)
+    return crosswalk_df
+
+def _read_result_sheet(sheet):
+    """
+    Streams one result sheet in the 3-row header layout and returns its data
+    as a ResultSheet.
+    Row 1 is a title row, Row 2 holds the pathogen names (Column D onwards),
+    Row 3 the 'Barcode'/'Panel' headers (Columns B and C) and the data starts
+    on Row 4. Column A is never read.
+    """
+    header_rows = []
+    data_rows = []
+    width = 0
+    # min_col=2 skips Column A; every index below is relative to Column B.
+    for row_number, row in enumerate(sheet.iter_rows(min_col=2)):
+        converted = [_convert_cell(c) for c in row]
+        row_width = _row_width(converted)
+        if row_width:
+            width = max(width, row_width)
+        if row_number < 3:
+            header_rows.append(converted)
+        else:
+            data_rows.append(converted[:row_width])
+
+    # Trim trailing empty rows (extra formatted rows below the data)
+    while data_rows and not data_rows[-1]:
+        data_rows.pop()
+    while len(header_rows) < 3:
+        header_rows.append([])
+    header_rows = [r + [np.nan] * (width - len(r)) for r in header_rows]
+
+    # 1. Pathogen names (Row 2, Column D onwards), forward-filled over merged cells
+    pathogen_headers = pd.Series(header_rows[1][2:width], dtype=object).ffill().tolist()
+
+    # 2. 'Barcode' and 'Panel' headers (Row 3, Columns B and C)
+    barcode_header = header_rows[2][0] if width > 0 else np.nan
+    panel_header = header_rows[2][1] if width > 1 else np.nan
+
+    # 3. Final, de-duplicated column names
+    clean_pathogen_headers = [h for h in pathogen_headers if pd.notna(h) and h != '']
+    final_column_names = [barcode_header, panel_header] + clean_pathogen_headers
+    final_column_names_unique = _deduplicate_columns(final_column_names)
+    num_cols = len(final_column_names_unique)
+
+    # 4. Data (Row 4 onwards), only the columns the headers describe
+    data = [r[:num_cols] + [np.nan] * (num_cols - len(r)) for r in data_rows]
+    data_subset = pd.DataFrame(data, columns=final_column_names_unique, dtype=object)
+
+    # Columns with no header text at all are plain numbers, as pandas inferred them
+    for i, col in enumerate(final_column_names_unique):
+        if all(_is_blank(r[i]) for r in header_rows):
+            try:
+                data_subset[col] = pd.to_numeric(data_subset[col])
+            except (ValueError, TypeError):
+                pass
+
+    # 5. Drop any rows where the Barcode is empty (e.g., extra empty rows)
+    data_subset = data_subset.dropna(subset=[final_column_names_unique[0]]).reset_index(drop=True)
+    return ResultSheet(data_subset, compact=config.COMPACT_RESULT_SHEETS)
+
+# --- COMPACT RESULT SHEETS ---
+# A parsed result sheet holds one boxed Python object per cell. ResultSheet
+# keeps the same data in compact columns instead:
+#
+#   numbers      a float64 column. Cells hold ints (30) and non-whole floats
+#                (31.5) only (see _convert_cell), so int-ness comes back exactly.
+#   text tokens  ('Pending' among the Ct values) kept per row on the side,
+#                with NaN in the float64 column
+#   repeated text  (Panel, 'Detected'/'Not Detected' columns) a categorical
+#
+# rows() turns the selected rows back into the exact values the sheet was
+# parsed to, so the rendered reports don't change.
+
+# A float64 holds every int up to here exactly
+_MAX_EXACT_INT = 2 ** 53
+
+def _encode_column(values):
+    """
+    Picks a compact form for one column of parsed cells. Returns
+    ('numeric', float64 array, {row: token}), ('category', Categorical, None)
+    or None to keep the column as objects.
+    """
+    numbers = np.full(len(values), np.nan)
+    tokens = {}
+    text = set()
+    for row, value in enumerate(values):
+        kind = type(value)
+        if kind is float:
+            numbers[row] = value  # NaN stays NaN
+        elif kind is int and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+            numbers[row] = value
+        elif kind is str:
+            tokens[row] = value
+            text.add(value)
+        else:
+            return None  # Dates, bools, huge ints: keep as they are
+    if len(tokens) <= len(values) // 2:
+        return 'numeric', numbers, tokens
+    if len(tokens) == len(values) or np.isnan(numbers).all():
+        if len(text) <= len(values) // 2:
+            return 'category', pd.Categorical(values), None
+    return None
+
+class ResultSheet(object):
+    """One parsed result sheet, stored compactly (see above)."""
+    def __init__(self, frame, compact=True):
+        self.columns = list(frame.columns)
+        self.object_bytes = int(frame.memory_usage(index=False, deep=True).sum())
+        self._tokens = {}  # column -> {row: text token}
+        self._numeric = set()
+        if compact:
+            encoded = {}
+            for col in self.columns[1:]:  # Barcode (the join key) stays as it is
+                if frame[col].dtype != object:
+                    continue
+                encoding = _encode_column(frame[col].tolist())
+                if encoding is None:
+                    continue
+                kind, values, tokens = encoding
+                encoded[col] = values
+                if kind == 'numeric':
+                    self._numeric.add(col)
+                    if tokens:
+                        self._tokens[col] = tokens
+            if encoded:
+                frame = pd.DataFrame({col: encoded.get(col, frame[col]) for col in self.columns}, columns=self.columns)
+        self.frame = frame
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def barcodes(self):
+        return self.frame[self.columns[0]]
+
+    def memory_bytes(self):
+        """Bytes held by the compact columns and the side tokens."""
+        size = int(self.frame.memory_usage(index=False, deep=True).sum())
+        for tokens in self._tokens.values():
+            size += sys.getsizeof(tokens) + sum(sys.getsizeof(token) for token in tokens.values())
+        return size
+
+    def rows(self, positions):
+        """The rows at positions (in that order) as an object frame of the parsed values."""
+        part = self.frame.iloc[positions].reset_index(drop=True)
+        columns = {}
+        for col in self.columns:
+            values = part[col]
+            if col in self._numeric:
+                decoded = [int(v) if v.is_integer() else v for v in values.tolist()]
+                tokens = self._tokens.get(col)
+                if tokens:
+                    for row, position in enumerate(positions):
+                        token = tokens.get(position)
+                        if token is not None:
+                            decoded[row] = token
+                columns[col] = pd.Series(decoded, dtype=object)
+            elif isinstance(values.dtype, pd.CategoricalDtype):
+                columns[col] = values.astype(object)
+            else:
+                columns[col] = values
+        return pd.DataFrame(columns, columns=self.columns)
+
+def memory_report(results_sheets):
+    """One line per result sheet: rows, columns and memory, compact vs. as objects."""
+    def size(n):
+        return f"{n / 1e6:.1f} MB" if n >= 1e6 else f"{n / 1e3:.0f} KB"
+
+    lines = []
+    for sheet_name, sheet in results_sheets.items():
+        lines.append(
+            f"  > Sheet '{sheet_name}': {len(sheet)} rows, {len(sheet.columns)} columns, "
+            f"{size(sheet.memory_bytes())} in memory ({size(sheet.object_bytes)} as objects)"
+        )
+    return lines
+
+def _open_workbook(results_path):
+    """Opens the lab results file in read-only (streaming) mode."""
+    return openpyxl.load_workbook(results_path, read_only=True, data_only=True, keep_links=False)
+
+def _read_required_sheets(workbook, crosswalk_df, results_path):
+    """Parses every result sheet the crosswalk references from an open workbook."""
+    results_sheets = {}
+    for sheet_name in crosswalk_df['Result Sheet'].unique():
+
+        # Check if the required sheet even exists in the file
+        if sheet_name not in workbook.sheetnames:
+            print(f"  > ERROR: Crosswalk references sheet '{sheet_name}' but it's not in the Excel file. Skipping this sheet.", file=sys.stderr)
+            continue
+
+        print(f"  > Parsing required sheet: {sheet_name}")
+        with tracing.span('read_sheet', 'load', sheet=sheet_name):
+            results_sheets[sheet_name] = _read_result_sheet(workbook[sheet_name])
+        print(memory_report({sheet_name: results_sheets[sheet_name]})[0])
+
+    if not results_sheets:
+        print(f"WARNING: No valid result sheets found in {results_path} that matched the Crosswalk.", file=sys.stderr)
+
+    return results_sheets
+
+def load_results_workbook(results_path, use_cache=True):
+    """
+    Loads the Crosswalk and every result sheet it references from the lab
+    results file, opening the workbook only once (or not at all on a cache hit).
+    Returns a (crosswalk_df, results_sheets) tuple; either may be None on failure.
+    """
+    print(f"--- Loading Crosswalk and Result Sheets from {results_path} ---")
+    cache_path = _cache_path(results_path, 'results') if use_cache else None
+    cached = _cache_get(cache_path)
+    if cached is not None:
+        print("  > Using cached copy (file unchanged since last parse)")
+        for line in memory_report(cached[1]):
+            print(line)
+        return cached
+
     try:
-        # Load the crosswalk and set 'Panel' as the index for easy lookup
-        crosswalk_df = pd.read_excel(results_path, sheet_name=config.CROSSWALK_SHEET_NAME)
-        crosswalk_df.set_index('Panel', inplace=True)
-        return crosswalk_df
+        workbook = _open_workbook(results_path)
     except FileNotFoundError:
         print(f"ERROR: Lab results file not found at {results_path}", file=sys.stderr)
-        return None
-    except KeyError:
-        print(f"ERROR: The file at {results_path} does not contain a sheet named '{config.CROSSWALK_SHEET_NAME}'", file=sys.stderr)
-        return None
+        return None, None
     except Exception as e:
-        print(f"ERROR: Failed to read crosswalk. {e}", file=sys.stderr)
-        return None
+        print(f"ERROR: Failed to read lab results file. {e}", file=sys.stderr)
+        return None, None
 
-def load_all_results_sheets(results_path, crosswalk_df):
+    try:
+        if config.CROSSWALK_SHEET_NAME not in workbook.sheetnames:
+            print(f"ERROR: The file at {results_path} does not contain a sheet named '{config.CROSSWALK_SHEET_NAME}'", file=sys.stderr)
+            return None, None
+        try:
+            with tracing.span('read_crosswalk', 'load'):
+                crosswalk_df = _read_crosswalk_sheet(workbook[config.CROSSWALK_SHEET_NAME])
+        except Exception as e:
+            print(f"ERROR: Failed to read crosswalk. {e}", file=sys.stderr)
+            return None, None
+
+        try:
+            results_sheets = _read_required_sheets(workbook, crosswalk_df, results_path)
+        except Exception as e:
+            print(f"ERROR: Failed to read results sheets from {results_path}. {e}", file=sys.stderr)
+            return crosswalk_df, None
+
+        if results_sheets:
+            _cache_put(cache_path, (crosswalk_df, results_sheets))
+        return crosswalk_df, results_sheets
+    finally:
+        # Read-only workbooks hold the file open until they are closed
+        workbook.close()
+
+def _merge_patient_side(results_part, patients_part):
     """
-    Loads all lab result sheets from the Excel file into a dictionary of DataFrames.
-    It skips the Crosswalk sheet and handles the new complex header format.
-    It now only loads sheets listed in the crosswalk.
+    Places the patient columns next to the result columns exactly as
+    pd.merge(result_row, patient_row.drop(columns=['Panel']), on='Barcode') did:
+    result columns first, then patient columns, '_x'/'_y' on any name clash.
     """
-    print(f"--- Loading All Result Sheets from {results_path} ---")
+    patients_part = patients_part.drop(columns=['Panel', 'Barcode'], errors='ignore')
+    overlap = set(results_part.columns) & set(patients_part.columns)
+    if overlap:
+        results_part = results_part.rename(columns={c: f"{c}_x" for c in overlap})
+        patients_part = patients_part.rename(columns={c: f"{c}_y" for c in overlap})
+    return pd.concat([results_part, patients_part], axis=1)
+
+# --- Crosswalk Plans ---
+# Panel -> (template path, result sheet), worked out once per crosswalk content
+# and template folder. Kept for the life of the process, so a long-running
+# watch_folder.py reuses it for every drop that brings the same crosswalk.
+_CROSSWALK_PLANS_KEPT = 8
+_crosswalk_plans = {}
+
+def crosswalk_plan(crosswalk_df, template_dir=None):
+    """Returns {panel: (template_path, result_sheet_name)} for a Crosswalk DataFrame."""
+    template_dir = template_dir or config.TEMPLATE_DIR
     try:
-        xls = pd.ExcelFile(results_path)
-        all_available_sheets = xls.sheet_names
-        
-        # Get a unique list of sheet names we *actually* need to parse
-        unique_sheets_to_load = crosswalk_df['Result Sheet'].unique()
-        
-        results_sheets = {}
-        for sheet_name in unique_sheets_to_load:
-            
-            # Check if the required sheet even exists in the file
-            if sheet_name not in all_available_sheets:
-                print(f"  > ERROR: Crosswalk references sheet '{sheet_name}' but it's not in the Excel file. Skipping this sheet.", file=sys.stderr)
+        entries = list(zip(crosswalk_df.index, crosswalk_df['Result Template'], crosswalk_df['Result Sheet']))
+    except KeyError:
+        return {} # No routing columns: every panel is missing from the Crosswalk
+    key = (template_dir, hashlib.sha256(repr(entries).encode('utf-8')).hexdigest())
+    plan = _crosswalk_plans.get(key)
+    if plan is None:
+        plan = {}
+        for panel, template_name, result_sheet_name in entries:
+            # Like crosswalk_df.loc[panel]: the first row for a panel wins
+            plan.setdefault(panel, (os.path.join(template_dir, f"{template_name}.tex"), result_sheet_name))
+        if len(_crosswalk_plans) >= _CROSSWALK_PLANS_KEPT:
+            _crosswalk_plans.clear()
+        _crosswalk_plans[key] = plan
+    return plan
+
+def join_patient_results(demographics_df, crosswalk_df, results_sheets, template_dir=None):
+    """
+    Matches every patient to their lab results with one indexed join per result sheet.
+
+    Patients are grouped by the result sheet their Panel maps to in the Crosswalk,
+    and each sheet is joined to its patients through a Barcode -> rows index
+    instead of scanning the sheet once per patient.
+
+    Returns (jobs, failure_count). jobs is a list of
+    (record_dict, template_path, patient_panel, result_sheet_name) tuples in
+    demographics order, and within a patient in results-sheet order.
+    failure_count counts patients that had to be skipped.
+    """
+    template_dir = template_dir or config.TEMPLATE_DIR
+    failure_count = 0
+    barcodes = demographics_df['Barcode']
+
+    # Step 1: Route each patient to a template and result sheet via the Crosswalk
+    # (see crosswalk_plan())
+    panel_routes = crosswalk_plan(crosswalk_df, template_dir)
+    template_exists = {}
+    routes = {}
+    patients_by_sheet = {}
+    for position, (patient_barcode, patient_panel) in enumerate(zip(barcodes, demographics_df['Panel'])):
+        route = panel_routes.get(patient_panel)
+        if route is None:
+            print(f"  > ERROR: Panel '{patient_panel}' for Barcode '{patient_barcode}' not found in Crosswalk. Skipping patient.", file=sys.stderr)
+            failure_count += 1
+            continue
+        template_path, result_sheet_name = route
+
+        if template_path not in template_exists:
+            template_exists[template_path] = os.path.exists(template_path)
+        if not template_exists[template_path]:
+            print(f"  > ERROR: Template file not found: {template_path}. Skipping patient.", file=sys.stderr)
+            failure_count += 1
+            continue
+
+        if result_sheet_name not in results_sheets:
+            print(f"  > ERROR: Result Sheet '{result_sheet_name}' (from Crosswalk) not found in Excel file. Skipping patient.", file=sys.stderr)
+            failure_count += 1
+            continue
+
+        routes[position] = (template_path, patient_panel, result_sheet_name)
+        patients_by_sheet.setdefault(result_sheet_name, []).append(position)
+
+    # Step 2: One indexed join per result sheet
+    records_by_patient = {}
+    for result_sheet_name, patient_positions in patients_by_sheet.items():
+        results_sheet = results_sheets[result_sheet_name]
+
+        # Barcode -> result row positions (in sheet order)
+        rows_by_barcode = {}
+        for row_position, barcode in enumerate(results_sheet.barcodes):
+            rows_by_barcode.setdefault(barcode, []).append(row_position)
+
+        left_rows = []
+        right_rows = []
+        for position in patient_positions:
+            patient_barcode = barcodes.iat[position]
+            # NaN never equals anything, so it never has results
+            if pd.isna(patient_barcode):
                 continue
-                
-            print(f"  > Parsing required sheet: {sheet_name}")
-            
-            # This new format is complex. We must read it in parts.
-            # header=None gets all data without assuming a header.
-            raw_df = xls.parse(sheet_name, header=None)
-            
-            # 1. Get Pathogen Names (from Row 2, Column D onwards)
-            # .iloc[1] = Row 2. [3:] = Column D onwards.
-            # --- UPDATED: Use .ffill() instead of .fillna(method='ffill') ---
-            pathogen_headers = raw_df.iloc[1, 3:].ffill().tolist()
-            
-            # 2. Get the 'Barcode' and 'Panel' headers (from Row 3)
-            # .iloc[2] = Row 3. [1] = Column B, [2] = Column C
-            barcode_header = raw_df.iloc[2, 1]
-            panel_header = raw_df.iloc[2, 2]
-            
-            # 3. Create the full list of final column names
-            #    (Filter out nans from headers before combining)
-            clean_pathogen_headers = [h for h in pathogen_headers if pd.notna(h) and h != '']
-            final_column_names = [barcode_header, panel_header] + clean_pathogen_headers
-            
-            # Deduplicate column names
-            final_column_names_unique = _deduplicate_columns(final_column_names)
-            
-            # 4. Get the actual data (from Row 4 onwards)
-            # .iloc[3:] = Row 4 onwards.
-            data_df = raw_df.iloc[3:]
-            
-            # 5. Select only the columns we need (Column B onwards)
-            # and stop at the end of our defined headers
-            num_cols = len(final_column_names_unique) # Use new unique list
-            # .iloc[:, 1:num_cols+1] = All rows, from Column B to (B + num_cols)
-            data_subset = data_df.iloc[:, 1:num_cols+1]
-            
-            # 6. Set the column names and reset the index
-            data_subset.columns = final_column_names_unique # Use new unique list
-            data_subset = data_subset.reset_index(drop=True)
-            
-            # 7. Drop any rows where the Barcode is empty (e.g., extra empty rows)
-            data_subset = data_subset.dropna(subset=[barcode_header]) # Use the dynamic header name
-            
-            results_sheets[sheet_name] = data_subset
-
-        if not results_sheets:
-            print(f"WARNING: No valid result sheets found in {results_path} that matched the Crosswalk.", file=sys.stderr)
-            
-        return results_sheets
-        
-    except FileNotFoundError:
-        print(f"ERROR: Lab results file not found at {results_path}", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"ERROR: Failed to read results sheets from {results_path}. {e}", file=sys.stderr)
-        return None
+            row_positions = rows_by_barcode.get(patient_barcode, [])
+            left_rows.extend(row_positions)
+            right_rows.extend([position] * len(row_positions))
+
+        if not left_rows:
+            continue
+
+        merged_df = _merge_patient_side(
+            results_sheet.rows(left_rows),
+            demographics_df.iloc[right_rows].reset_index(drop=True)
+        )
+        for position, record_dict in zip(right_rows, merged_df.to_dict('records')):
+            records_by_patient.setdefault(position, []).append(record_dict)
+
+    # Step 3: Emit jobs in the original patient-by-patient order
+    jobs = []
+    for position in sorted(routes):
+        template_path, patient_panel, result_sheet_name = routes[position]
+        if position not in records_by_patient:
+            print(f"  > INFO: No results found for Barcode '{barcodes.iat[position]}' in sheet '{result_sheet_name}'.")
+            continue
+        for record_dict in records_by_patient[position]:
+            jobs.append((record_dict, template_path, patient_panel, result_sheet_name))
+
+    return jobs, failure_count
 
 
 def validate_data(df_row, row_index):
@@ -2,12 +2,17 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, font
 import sys
 import threading
+import collections
+import logging
+import logging.handlers
 import os
 import shutil
-import pandas as pd
 import config
 import data_handler
 import report_compiler
+import pipeline
+import progress
+import tracing
 import warnings
 
 # Suppress warnings
@@ -16,38 +21,95 @@ warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 class SmartRedirector(object):
     """
     Redirects print statements to the GUI text widget.
-    Colors text RED if it contains "WARNING" or "ERROR".
+
+    Writes (from any thread) are queued as whole lines and added to the widget
+    in one batch every config.GUI_LOG_FLUSH_MS; the widget keeps the last
+    config.GUI_LOG_MAX_LINES lines. Every line also goes to the log file.
+    Each line is colored by the marker it starts with, after any "  > "
+    (ERROR:, WARNING:, SUCCESS:, --- Processing; see _line_tag). A line that
+    only mentions ERROR or WARNING further on is not colored.
     """
     def __init__(self, widget):
         self.widget = widget
+        # Lines not shown yet. Bounded: older ones would scroll out anyway
+        self._pending = collections.deque(maxlen=config.GUI_LOG_MAX_LINES)
+        self._partial = threading.local() # Each thread's unfinished line
+        try:
+            self._log_file = _open_log_file()
+        except OSError as e:
+            self._log_file = None
+            self.write(f"WARNING: Could not open the log file: {e}\n")
+        self.widget.after(config.GUI_LOG_FLUSH_MS, self._flush_to_widget)
 
     def write(self, str_text):
         if not str_text: return
-        self.widget.after(0, self._append_text, str_text)
+        lines = (getattr(self._partial, 'text', '') + str_text).split("\n")
+        self._partial.text = lines.pop()
+        for line in lines:
+            self._pending.append(line)
+            if self._log_file is not None:
+                self._log_file.info(line)
+
+    def _flush_to_widget(self):
+        try:
+            lines = []
+            while self._pending:
+                lines.append(self._pending.popleft())
+            if lines:
+                self._append_lines(lines)
+        finally:
+            self.widget.after(config.GUI_LOG_FLUSH_MS, self._flush_to_widget)
+
+    def _append_lines(self, lines):
+        # One insert for the whole batch: text, tag, text, tag, ...
+        chunks = []
+        for line in lines:
+            chunks.extend((line + "\n", (_line_tag(line),)))
 
-    def _append_text(self, text):
         self.widget.configure(state="normal")
-        
-        # Determine tag based on content
-        tag = "normal"
-        upper_text = text.upper()
-        
-        if "ERROR" in upper_text or "FAIL" in upper_text:
-            tag = "error"
-        elif "WARNING" in upper_text:
-            tag = "warning"
-        elif "SUCCESS" in upper_text:
-            tag = "success"
-        elif "PROCESSING" in upper_text:
-            tag = "info"
-            
-        self.widget.insert("end", text, (tag,))
+        self.widget.insert("end", *chunks)
+        line_count = int(self.widget.index("end-1c").split(".")[0]) - 1
+        if line_count > config.GUI_LOG_MAX_LINES:
+            self.widget.delete("1.0", f"{line_count - config.GUI_LOG_MAX_LINES + 1}.0")
         self.widget.see("end")
         self.widget.configure(state="disabled")
 
     def flush(self):
         pass
 
+# Tag by the marker a line starts with ("  > ERROR: ...", "  > ✅ SUCCESS: ...");
+# report outcomes themselves come from the pipeline's progress events.
+_LINE_MARKERS = [
+    ("ERROR", "error"), ("CRITICAL ERROR", "error"), ("UNEXPECTED ERROR", "error"),
+    ("WARNING", "warning"), ("❗ WARNING", "warning"),
+    ("SUCCESS", "success"), ("✅ SUCCESS", "success"),
+    ("--- Processing", "info"),
+]
+
+def _line_tag(text):
+    """Determine tag based on the line's leading marker"""
+    head = text.lstrip(" >")
+    for marker, tag in _LINE_MARKERS:
+        if head.startswith(marker):
+            return tag
+    return "normal"
+
+def _open_log_file():
+    """Logger writing to LOG_DIR/gui.log, rotated by size."""
+    logger = logging.getLogger("xgene.gui")
+    if logger.handlers:
+        return logger
+    os.makedirs(config.LOG_DIR, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        os.path.join(config.LOG_DIR, "gui.log"), maxBytes=config.LOG_FILE_MAX_BYTES,
+        backupCount=config.LOG_FILE_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
 class EnterpriseReportApp:
     def __init__(self, root):
         self.root = root
@@ -95,6 +157,12 @@ class EnterpriseReportApp:
         self.demographics_path = tk.StringVar()
         self.results_path = tk.StringVar()
         self.output_path = tk.StringVar()
+        self.use_cache = tk.BooleanVar(value=True)
+        self.rebuild_all = tk.BooleanVar(value=False)
+        self.compile_jobs = tk.IntVar(value=config.COMPILE_JOBS or os.cpu_count() or 1)
+        self.batch_size = tk.IntVar(value=config.COMPILE_BATCH_SIZE or 1)
+        self.zip_archive = tk.BooleanVar(value=config.ARCHIVE_ZIP)
+        self.profile_run = tk.BooleanVar(value=False)
 
         # --- LAYOUT CONSTRUCTION ---
         self.sidebar = tk.Frame(root, bg=self.c["sidebar_bg"], width=280)
@@ -182,6 +250,31 @@ class EnterpriseReportApp:
                                  cursor="hand2", command=self.start_generation_thread)
         self.run_btn.pack(side=tk.RIGHT)
 
+        tk.Checkbutton(btn_frame, text="Reuse parsed files (cache)", variable=self.use_cache,
+                       bg=self.c["card_bg"], fg=self.c["text_dark"], activebackground=self.c["card_bg"],
+                       font=self.f_norm, cursor="hand2").pack(side=tk.LEFT)
+        tk.Button(btn_frame, text="Clear Cache", command=self.clear_cache,
+                  bg=self.c["main_bg"], fg=self.c["text_dark"], relief="flat",
+                  padx=12, pady=3, cursor="hand2").pack(side=tk.LEFT, padx=15)
+        tk.Checkbutton(btn_frame, text="Rebuild All", variable=self.rebuild_all,
+                       bg=self.c["card_bg"], fg=self.c["text_dark"], activebackground=self.c["card_bg"],
+                       font=self.f_norm, cursor="hand2").pack(side=tk.LEFT)
+
+        tk.Label(btn_frame, text="Parallel Jobs", bg=self.c["card_bg"], fg=self.c["text_dark"],
+                 font=self.f_norm).pack(side=tk.LEFT, padx=(10, 5))
+        tk.Spinbox(btn_frame, from_=1, to=max(64, os.cpu_count() or 1), textvariable=self.compile_jobs,
+                   width=4, font=self.f_norm, relief="flat", bg=self.c["input_bg"]).pack(side=tk.LEFT)
+        tk.Label(btn_frame, text="Batch Size", bg=self.c["card_bg"], fg=self.c["text_dark"],
+                 font=self.f_norm).pack(side=tk.LEFT, padx=(10, 5))
+        tk.Spinbox(btn_frame, from_=1, to=100, textvariable=self.batch_size,
+                   width=4, font=self.f_norm, relief="flat", bg=self.c["input_bg"]).pack(side=tk.LEFT)
+        tk.Checkbutton(btn_frame, text="Zip Archive per Sheet", variable=self.zip_archive,
+                       bg=self.c["card_bg"], fg=self.c["text_dark"], activebackground=self.c["card_bg"],
+                       font=self.f_norm, cursor="hand2").pack(side=tk.LEFT, padx=(10, 0))
+        tk.Checkbutton(btn_frame, text="Profile Run", variable=self.profile_run,
+                       bg=self.c["card_bg"], fg=self.c["text_dark"], activebackground=self.c["card_bg"],
+                       font=self.f_norm, cursor="hand2").pack(side=tk.LEFT, padx=(10, 0))
+
         log_card = self._create_card(self.pad, "System Execution Logs")
         log_card.pack(fill=tk.BOTH, expand=True)
         
@@ -205,6 +298,9 @@ class EnterpriseReportApp:
         self.status_lbl = tk.Label(status_frame, text="System Ready", font=("Segoe UI", 9, "bold"), 
                                    bg=self.c["status_bar"], fg=self.c["status_fg"])
         self.status_lbl.pack(side=tk.LEFT, fill=tk.Y)
+
+        self.progress_bar = ttk.Progressbar(status_frame, orient="horizontal", length=260, mode="determinate")
+        self.progress_bar.pack(side=tk.LEFT, padx=20)
         
         tk.Label(status_frame, text="X-Gene LIS Connected", font=("Segoe UI", 9), 
                  bg=self.c["status_bar"], fg="#90A4AE").pack(side=tk.RIGHT, fill=tk.Y)
@@ -244,28 +340,57 @@ class EnterpriseReportApp:
         d = filedialog.askdirectory()
         if d: self.output_path.set(d)
 
+    def clear_cache(self):
+        removed = data_handler.clear_cache()
+        print(f"INFO: Cleared {removed} parsed-file cache entries.")
+
     def start_generation_thread(self):
         self.run_btn.config(state="disabled", bg="#B0BEC5", text="PROCESSING...")
         self.status_lbl.config(text="Processing Request...", fg="#FFFFFF")
         self.log_widget.configure(state="normal")
         self.log_widget.delete(1.0, tk.END)
         self.log_widget.configure(state="disabled")
+        self.tracker = progress.ProgressTracker()
+        self.progress_bar.config(value=0, maximum=1)
         threading.Thread(target=self.run_process, daemon=True).start()
+        self._refresh_progress()
+
+    def _refresh_progress(self):
+        """Shows the run's progress events: bar, reports per minute and ETA."""
+        tracker = self.tracker
+        if tracker.total:
+            self.progress_bar.config(maximum=tracker.total, value=tracker.done)
+            self.status_lbl.config(text=tracker.status_line())
+        if not tracker.finished:
+            self.root.after(250, self._refresh_progress)
 
     def _finish(self, total, success, fail):
         self.run_btn.config(state="normal", bg=self.c["accent"], text="INITIATE BATCH PROCESSING")
-        self.status_lbl.config(text="Processing Complete", fg=self.c["status_fg"])
+        self.status_lbl.config(text=f"Processing Complete | {self.tracker.status_line()}", fg=self.c["status_fg"])
         messagebox.showinfo("Report Summary", f"Batch Complete.\n\nTotal: {total}\nSuccess: {success}\nFailed: {fail}")
 
     def _reset_error(self):
         self.run_btn.config(state="normal", bg=self.c["accent"], text="INITIATE BATCH PROCESSING")
         self.status_lbl.config(text="System Error", fg="#EF5350")
+        self.tracker(progress.ProgressEvent(progress.FINISHED)) # Stops the progress updates
 
     def run_process(self):
         try:
             d_path = self.demographics_path.get()
             r_path = self.results_path.get()
             copy_dest = self.output_path.get()
+            use_cache = self.use_cache.get()
+            rebuild_all = self.rebuild_all.get()
+            zip_archive = self.zip_archive.get()
+            profile_run = self.profile_run.get()
+            try:
+                compile_jobs = max(1, self.compile_jobs.get())
+            except tk.TclError:
+                compile_jobs = None # Invalid entry: fall back to the default
+            try:
+                batch_size = max(1, self.batch_size.get())
+            except tk.TclError:
+                batch_size = None
 
             if not d_path or not r_path:
                 print("ERROR: Missing input files.")
@@ -274,87 +399,55 @@ class EnterpriseReportApp:
 
             print("--- Starting Batch Analysis ---")
             
-            if os.path.exists(config.OUTPUT_DIR):
+            # The output folder is kept between runs so unchanged reports aren't
+            # compiled again; "Rebuild All" starts from an empty folder instead.
+            if rebuild_all and os.path.exists(config.OUTPUT_DIR):
                 try:
                     shutil.rmtree(config.OUTPUT_DIR)
-                    os.makedirs(config.OUTPUT_DIR)
                     print(f"INFO: Output directory cleaned: {config.OUTPUT_DIR}")
                 except Exception as e:
                     print(f"WARNING: Could not clean output directory: {e}")
-            else:
-                os.makedirs(config.OUTPUT_DIR)
+            os.makedirs(config.OUTPUT_DIR, exist_ok=True)
             
-            demographics_df = data_handler.load_demographics(d_path)
-            crosswalk_df = data_handler.load_crosswalk(r_path)
-            results_sheets_dict = data_handler.load_all_results_sheets(r_path, crosswalk_df)
-
-            if demographics_df is None or crosswalk_df is None or not results_sheets_dict:
+            # Loading, rendering, compiling and archiving overlap: each PDF is
+            # archived as soon as it is ready (see pipeline.py and archiver.py)
+            archive_folder = copy_dest if copy_dest and os.path.isdir(copy_dest) else None
+            trace_path = os.path.join(config.OUTPUT_DIR, f"{config.PROFILE_TRACE_NAME}.json")
+            if profile_run:
+                tracing.start()
+            try:
+                summary = pipeline.run_pipeline(
+                    d_path, r_path,
+                    use_cache=use_cache,
+                    jobs=compile_jobs,
+                    batch_size=batch_size,
+                    archive_folder=archive_folder,
+                    zip_bundles=zip_archive,
+                    on_progress=self.tracker,
+                )
+            finally:
+                profile = tracing.stop(trace_path) if profile_run else []
+
+            if summary is None:
                 print("CRITICAL ERROR: Data Verification Failed.")
                 self.root.after(0, self._reset_error)
                 return
 
-            success = 0
-            fail = 0
-            total_reports = 0
-
-            for _, patient_row in demographics_df.iterrows():
-                p_code = patient_row['Barcode']
-                p_panel = patient_row['Panel']
-                
-                try:
-                    entry = crosswalk_df.loc[p_panel]
-                    t_name = entry['Result Template']
-                    s_name = entry['Result Sheet']
-                except KeyError:
-                    print(f"Skipping {p_code}: Panel '{p_panel}' unknown.")
-                    fail += 1
-                    continue
-
-                t_path = os.path.join(config.TEMPLATE_DIR, f"{t_name}.tex")
-                if not os.path.exists(t_path):
-                    print(f"Skipping {p_code}: Template '{t_name}' missing.")
-                    fail += 1
-                    continue
-
-                if s_name not in results_sheets_dict:
-                    print(f"Skipping {p_code}: Sheet '{s_name}' missing.")
-                    fail += 1
-                    continue
-                
-                res_df = results_sheets_dict[s_name]
-                p_res_df = res_df[res_df['Barcode'] == p_code]
-
-                if p_res_df.empty:
-                    print(f"Info: No results for {p_code} in '{s_name}'.")
-                    continue
-                
-                total_reports += len(p_res_df)
-
-                for _, res_row in p_res_df.iterrows():
-                    p_df = pd.DataFrame([patient_row])
-                    r_df = pd.DataFrame([res_row])
-                    merged = pd.merge(r_df, p_df.drop(columns=['Panel']), on='Barcode', how='left')
-                    rec = merged.to_dict('records')[0]
-                    
-                    if report_compiler.compile_single_report(rec, t_path, config.OUTPUT_DIR, p_panel, s_name):
-                        success += 1
-                    else:
-                        fail += 1
-
-            if copy_dest and os.path.isdir(copy_dest):
-                print(f"Archiving files to: {copy_dest}")
-                count = 0
-                for root, _, files in os.walk(config.OUTPUT_DIR):
-                    for f in files:
-                        if f.lower().endswith(".pdf"):
-                            src = os.path.join(root, f)
-                            rel = os.path.relpath(root, config.OUTPUT_DIR)
-                            dst_dir = os.path.join(copy_dest, rel)
-                            if not os.path.exists(dst_dir): os.makedirs(dst_dir)
-                            shutil.copy2(src, os.path.join(dst_dir, f))
-                            count += 1
-                print(f"SUCCESS: Archived {count} files.")
-
+            total_reports, success, fail = summary.total, summary.success, summary.failure
+            if archive_folder:
+                print(f"SUCCESS: Archived {summary.archived} files.")
+
+            for line in report_compiler.failure_summary():
+                print(f"ERROR:{line}")
+            timing = report_compiler.timing_summary()
+            if timing:
+                print("INFO: Compile time per template:")
+                for line in timing:
+                    print(line)
+            if profile_run:
+                print(f"INFO: Profile written to {trace_path}")
+                for line in profile:
+                    print(line)
             print(f"Batch Finished. Success: {success}, Failed: {fail}")
             self.root.after(0, lambda: self._finish(total_reports, success, fail))
 
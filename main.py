@@ -1,11 +1,34 @@
 import config
 import data_handler
 import report_compiler
+import pipeline
+import progress
+import tracing
+import sharding
 import os
 import sys
-import pandas as pd
 import argparse # <-- Import the argparse library
 
+def _seconds(text):
+    """--timeout value: seconds >= 0 (0 = no limit). For argparse's type=."""
+    try:
+        seconds = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number of seconds, got '{text}'")
+    if not seconds >= 0:
+        raise argparse.ArgumentTypeError(f"must be 0 (no limit) or more, got '{text}'")
+    return seconds
+
+def positive_int(text):
+    """A count of 1 or more. For argparse's type=."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got '{text}'")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be 1 or more, got '{text}'")
+    return value
+
 def main():
     """Main function to orchestrate the report generation process."""
     
@@ -21,6 +44,76 @@ def main():
         help="Path to the lab results Excel file (containing the Crosswalk).", 
         required=True
     )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Parse the Excel files from scratch instead of using (or updating) the parsed-file cache."
+    )
+    parser.add_argument(
+        '--clear-cache',
+        action='store_true',
+        help="Delete every parsed-file cache entry before loading."
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=None,
+        help="Number of reports to compile in parallel (default: one per CPU core)."
+    )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help="Compile every report, even those already up to date in the output folder."
+    )
+    parser.add_argument(
+        '--timeout',
+        type=_seconds,
+        default=None,
+        help=f"Seconds a report may spend in pdflatex before it is stopped; 0 for no limit (default: {config.COMPILE_TIMEOUT})."
+    )
+    parser.add_argument(
+        '-b', '--batch-size',
+        type=int,
+        default=None,
+        help="Number of reports of the same template to typeset in one pdflatex job (default: 1, no batching)."
+    )
+    parser.add_argument(
+        '--archive',
+        default=None,
+        help="Folder to copy each finished report PDF to, as soon as it is ready."
+    )
+    parser.add_argument(
+        '--archive-zip',
+        action='store_true',
+        help="Also bundle each result sheet's archived PDFs into <archive>/<sheet>.zip."
+    )
+    parser.add_argument(
+        '--bundle',
+        action='append',
+        choices=sorted(config.BUNDLE_FIELDS),
+        default=None,
+        help="Also concatenate the PDFs into one bookmarked bundle per physician or facility (may be given twice)."
+    )
+    parser.add_argument(
+        '--bundle-folder',
+        default=None,
+        help="Folder for the bundles (default: output/bundles)."
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const=os.path.join(config.OUTPUT_DIR, f"{config.PROFILE_TRACE_NAME}.json"),
+        default=None,
+        metavar='TRACE_FILE',
+        help="Time every stage of the run and write a Chrome trace (default: output/trace.json)."
+    )
+    parser.add_argument(
+        '--shard',
+        type=sharding.parse_shard,
+        default=None,
+        metavar='K/N',
+        help="Only generate shard K of N (by Barcode + TestID), into output/shard-K-of-N. Merge the shards with sharding.py."
+    )
     args = parser.parse_args()
     # --- End of new argument parsing ---
 
@@ -28,104 +121,82 @@ def main():
     print("   Automated Patient Report Generator (Multi-Panel)")
     print("=============================================")
     
-    # Step 1: Load all necessary data (using paths from 'args')
-    demographics_df = data_handler.load_demographics(args.demographics)
-    crosswalk_df = data_handler.load_crosswalk(args.results)
-    
-    # CRITICAL CHANGE: Pass the crosswalk_df to the sheet loader.
-    # This tells the loader *which* sheets to parse, avoiding junk sheets.
-    results_sheets_dict = data_handler.load_all_results_sheets(args.results, crosswalk_df)
+    if args.clear_cache:
+        removed = data_handler.clear_cache()
+        print(f"INFO: Cleared {removed} parsed-file cache entries.")
+
+    if args.timeout is not None:
+        config.COMPILE_TIMEOUT = args.timeout
 
-    if demographics_df is None or crosswalk_df is None or not results_sheets_dict:
+    # Steps 1-5 run as one pipeline (see pipeline.py): both workbooks are
+    # loaded, every patient is matched to their lab results through the
+    # Crosswalk, and the records are validated, rendered and compiled chunk by
+    # chunk, so pdflatex starts on the first reports while the rest are still
+    # being rendered. Reports already built from the same data and template
+    # (per the build manifest) are skipped.
+    # In a terminal, a progress line (reports done, rate, ETA) stays below the log
+    terminal = progress.TerminalProgress(sys.stdout) if sys.stdout.isatty() else None
+    stdout, stderr = sys.stdout, sys.stderr
+    if terminal is not None:
+        sys.stdout, sys.stderr = terminal.writer(stdout), terminal.writer(stderr)
+    # With --shard, this machine only builds its slice of the reports, into its own tree
+    output_folder, selector = None, None
+    if args.shard:
+        output_folder = sharding.shard_folder(*args.shard)
+        selector = sharding.ShardSelector(*args.shard)
+        print(f"INFO: Generating shard {args.shard[0]} of {args.shard[1]} into {output_folder}")
+    if args.profile:
+        tracing.start()
+    try:
+        summary = pipeline.run_pipeline(
+            args.demographics, args.results,
+            output_folder=output_folder,
+            use_cache=not args.no_cache,
+            jobs=args.jobs,
+            batch_size=args.batch_size,
+            rebuild=args.rebuild,
+            archive_folder=args.archive,
+            zip_bundles=args.archive_zip or None,
+            separator="-" * 45,
+            on_progress=terminal,
+            select=selector,
+            bundle_by=args.bundle,
+            bundle_folder=args.bundle_folder,
+        )
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        profile = tracing.stop(args.profile) if args.profile else []
+    if summary is None:
         print("ERROR: Failed to load critical data. Exiting.", file=sys.stderr)
         return
 
-    print("\n--- Starting Report Generation Process ---")
-    
-    success_count = 0
-    failure_count = 0
-    total_reports_to_generate = 0
-
-    # Step 2: Iterate through each PATIENT in the demographics file
-    for _, patient_row in demographics_df.iterrows():
-        patient_barcode = patient_row['Barcode']
-        patient_panel = patient_row['Panel'] # This is the Panel name, e.g., "WHP"
-        
-        # Step 3: Use the Crosswalk to find the correct template and sheet
-        try:
-            crosswalk_entry = crosswalk_df.loc[patient_panel]
-            template_name = crosswalk_entry['Result Template']
-            result_sheet_name = crosswalk_entry['Result Sheet'] # This is the sheet, e.g., "WH" or "UTI"
-        except KeyError:
-            print(f"  > ERROR: Panel '{patient_panel}' for Barcode '{patient_barcode}' not found in Crosswalk. Skipping patient.", file=sys.stderr)
-            failure_count += 1
-            continue
-
-        # Construct the full path to the required .tex template
-        template_path = os.path.join(config.TEMPLATE_DIR, f"{template_name}.tex")
-        if not os.path.exists(template_path):
-            print(f"  > ERROR: Template file not found: {template_path}. Skipping patient.", file=sys.stderr)
-            failure_count += 1
-            continue
-
-        # Step 4: Get the correct results DataFrame (e.g., the 'WH' sheet)
-        if result_sheet_name not in results_sheets_dict:
-            print(f"  > ERROR: Result Sheet '{result_sheet_name}' (from Crosswalk) not found in Excel file. Skipping patient.", file=sys.stderr)
-            failure_count += 1
-            continue
-        
-        results_df = results_sheets_dict[result_sheet_name]
-
-        # Step 5: Find all results for this patient in that sheet
-        patient_results_df = results_df[results_df['Barcode'] == patient_barcode]
-
-        if patient_results_df.empty:
-            print(f"  > INFO: No results found for Barcode '{patient_barcode}' in sheet '{result_sheet_name}'.")
-            continue
-            
-        total_reports_to_generate += len(patient_results_df)
-
-        # Step 6: Iterate through each LAB RESULT for that patient
-        for result_index, result_row in patient_results_df.iterrows():
-            
-            # Merge patient info + one lab result
-            # Need to convert rows to DataFrames for a clean merge
-            patient_df_row = pd.DataFrame([patient_row])
-            result_df_row = pd.DataFrame([result_row])
-            
-            # Merge on Barcode, dropping duplicate columns from the patient info
-            merged_record_df = pd.merge(result_df_row, patient_df_row.drop(columns=['Panel']), on='Barcode', how='left')
-
-            # Step 7: Validate the single, merged record
-            # --- REMOVED OLD VALIDATION CALL HERE ---
-            # The validation is now handled inside compile_single_report in report_compiler.py
-            # data_handler.validate_data(merged_record_df, f"{result_sheet_name} row {result_index + 2}")
-            
-            # Convert the single-row DataFrame back to a dictionary for compilation
-            record_dict = merged_record_df.to_dict('records')[0]
-            
-            # Step 8: Compile the report
-            # --- UPDATED: Pass patient_panel and result_sheet_name ---
-            success = report_compiler.compile_single_report(
-                record_dict, 
-                template_path,
-                config.OUTPUT_DIR,
-                patient_panel,      # e.g., "WHP" or "WIP-CPP+WHP"
-                result_sheet_name   # e.g., "WH" or "UTI"
-            )
-            if success:
-                success_count += 1
-            else:
-                failure_count += 1
-            print("-" * 45)
-
-    # Step 9: Print a final summary
+    # Step 6: Print a final summary
     print("=============================================")
     print("      Report Generation Summary")
-    print(f"  Total reports found to generate: {total_reports_to_generate}")
-    print(f"  Successfully generated: {success_count} reports")
-    if failure_count > 0:
-        print(f"  Failed to generate:   {failure_count} reports (see errors above)")
+    print(f"  Total reports found to generate: {summary.total}")
+    print(f"  Successfully generated: {summary.success} reports")
+    if summary.failure > 0:
+        print(f"  Failed to generate:   {summary.failure} reports (see errors above)")
+        for line in report_compiler.failure_summary():
+            print(f"  {line}")
+    if args.shard:
+        print(f"  Left to other shards: {summary.left_out} reports")
+        print(f"  Shard summary written to {sharding.write_shard_summary(output_folder, selector, summary)}")
+    if args.archive:
+        print(f"  Archived: {summary.archived} reports to {args.archive}")
+    if summary.bundles:
+        print(f"  Bundles: {summary.bundles} written")
+    if terminal is not None:
+        print(f"  Progress: {terminal.tracker.status_line()}")
+    timing = report_compiler.timing_summary()
+    if timing:
+        print("  Compile time per template:")
+        for line in timing:
+            print(f"  {line}")
+    if args.profile:
+        print(f"  Profile written to {args.profile}")
+        for line in profile:
+            print(line)
     print("=============================================")
 
 if __name__ == '__main__':
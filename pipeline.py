@@ -0,0 +1,424 @@
+import os
+import sys
+import asyncio
+import collections
+import threading
+import config
+import data_handler
+import report_compiler
+import report_rules
+import build_manifest
+import archiver
+import bundler
+import progress
+import tracing
+from concurrent.futures import ThreadPoolExecutor
+
+# --- REPORT PIPELINE ---
+# One run of the report generator as four stages connected by bounded queues:
+#
+#   load -> [chunks of jobs] -> render -> [tasks] -> compile -> [PDFs] -> archive -> [PDFs] -> bundle
+#
+# load      reads both workbooks (side by side) and joins patients to results
+# render    validates and renders the \ValSet blocks, a chunk of records at a time
+# compile   skips up-to-date reports and runs pdflatex, config.COMPILE_JOBS at once
+# archive   publishes each finished PDF to the archive folder (archiver.py)
+# bundle    writes each physician/facility bundle once its last report is done (bundler.py)
+#
+# Python work (loading, rendering) runs in a small thread pool, pdflatex jobs,
+# archive copies and bundles in their own, so rendering the next records overlaps the
+# running TeX jobs. The queues keep rendering at most a few reports per job ahead.
+_DONE = None  # End of a stage's output
+
+class PipelineSummary(object):
+    """What a run did, for main.py and the GUI to report."""
+    def __init__(self):
+        self.total = 0
+        self.success = 0
+        self.failure = 0
+        self.up_to_date = 0
+        self.problems = 0
+        self.validation_report = None
+        self.archived = 0
+        self.left_out = 0  # Reports select() left out
+        self.bundles = 0
+
+def run_pipeline(demographics_path, results_path, output_folder=None, use_cache=True, jobs=None,
+                 batch_size=None, rebuild=False, archive_folder=None, zip_bundles=None, separator=None,
+                 on_progress=None, select=None, bundle_by=None, bundle_folder=None):
+    """
+    Generates every report, from the two workbooks to the archived PDFs.
+
+    jobs is the number of pdflatex jobs run at once (config.COMPILE_JOBS / the
+    CPU count when None). batch_size is the number of reports typeset per
+    pdflatex job (config.COMPILE_BATCH_SIZE when None; 1 compiles each report
+    on its own). Each job is stopped after config.COMPILE_TIMEOUT seconds and
+    timed-out reports are retried config.COMPILE_RETRIES times. Reports
+    already up to date in output_folder are skipped unless rebuild is set.
+    Finished PDFs are published to archive_folder, when given (see
+    archiver.Archiver; zip_bundles defaults to config.ARCHIVE_ZIP).
+    on_progress, when given, is called with a progress.ProgressEvent as each
+    report moves through the stages (see progress.py). select, when given, is
+    called with each joined job (record_dict, template_path, panel,
+    result_sheet_name) and leaves out the reports it returns False for.
+    bundle_by lists the config.BUNDLE_FIELDS to bundle the PDFs by (default
+    config.BUNDLE_BY), into bundle_folder (default <output_folder>/bundles).
+    Returns a PipelineSummary, or None if the input data couldn't be loaded.
+    """
+    output_folder = output_folder or config.OUTPUT_DIR
+    jobs = jobs or config.COMPILE_JOBS or os.cpu_count() or 1
+    batch_size = batch_size or config.COMPILE_BATCH_SIZE or 1
+    if zip_bundles is None:
+        zip_bundles = config.ARCHIVE_ZIP
+    if bundle_by is None:
+        bundle_by = config.BUNDLE_BY
+    bundle_folder = bundle_folder or os.path.join(output_folder, config.BUNDLE_DIR_NAME)
+    return asyncio.run(_run(
+        demographics_path, results_path, output_folder, use_cache, jobs, batch_size, rebuild,
+        archive_folder, zip_bundles, separator, on_progress, select, bundle_by, bundle_folder
+    ))
+
+async def _run(demographics_path, results_path, output_folder, use_cache, jobs, batch_size, rebuild,
+               archive_folder, zip_bundles, separator, on_progress, select, bundle_by, bundle_folder):
+    loop = asyncio.get_running_loop()
+
+    def notify(kind, report=None, **details):
+        if on_progress is not None:
+            on_progress(progress.ProgressEvent(kind, report, **details))
+
+    summary = PipelineSummary()
+    work_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='xg-work')
+    latex_pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='xg-latex')
+
+    # Worker output is collected per compile unit and printed in one piece
+    local = threading.local()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = report_compiler._ThreadOutput(stdout, local)
+    sys.stderr = report_compiler._ThreadOutput(stderr, local)
+    manifest = None
+    try:
+        # Step 1: Load both workbooks at once
+        demographics_df, (crosswalk_df, results_sheets) = await asyncio.gather(
+            loop.run_in_executor(work_pool, _traced, 'load_demographics', data_handler.load_demographics, demographics_path, use_cache),
+            loop.run_in_executor(work_pool, _traced, 'load_results_workbook', data_handler.load_results_workbook, results_path, use_cache),
+        )
+        if demographics_df is None or crosswalk_df is None or not results_sheets:
+            return None
+
+        print("\n--- Starting Report Generation Process ---")
+        report_jobs, summary.failure = await loop.run_in_executor(
+            work_pool, _traced, 'join', data_handler.join_patient_results, demographics_df, crosswalk_df, results_sheets
+        )
+        if select is not None:
+            selected = [job for job in report_jobs if select(job)]
+            summary.left_out = len(report_jobs) - len(selected)
+            report_jobs = selected
+        summary.total = len(report_jobs)
+        notify(progress.STARTED, count=summary.total)
+
+        # The precomputed result rules are only used with templates they were checked against
+        await loop.run_in_executor(
+            work_pool, _traced, 'check_rules', report_rules.check_templates, [job[1] for job in report_jobs], output_folder
+        )
+
+        report_compiler.reset_compile_stats()
+        manifest = build_manifest.BuildManifest(output_folder)
+        if rebuild:
+            manifest.entries.clear()
+        session = report_compiler.CompileSession(manifest)
+
+        # Reports writing the same output file, which are compiled together in run order
+        key_counts = collections.Counter(_job_key(job) for job in report_jobs)
+        shared_keys = {key: count for key, count in key_counts.items() if count > 1}
+
+        depth = max(1, config.PIPELINE_QUEUE_DEPTH) * jobs
+        chunks = asyncio.Queue(maxsize=2)
+        tasks = asyncio.Queue(maxsize=depth * batch_size)
+        finished = asyncio.Queue(maxsize=depth)
+        settled = None
+
+        stages = [
+            _produce(report_jobs, chunks, notify),
+            _render(loop, work_pool, chunks, tasks, output_folder, summary, notify),
+            _compile(loop, latex_pool, tasks, finished, session, shared_keys, jobs, batch_size, separator, local, notify),
+        ]
+        if bundle_by and bundler.available():
+            bundles = bundler.Bundler(output_folder, bundle_folder, bundle_by)
+            bundles.plan((_job_key(job), job[0], job[2]) for job in report_jobs)
+            settled = asyncio.Queue(maxsize=depth)
+            stages.append(_bundle(loop, settled, bundles, summary))
+        stages.append(_archive(loop, finished, settled, output_folder, archive_folder, zip_bundles, summary, notify))
+        await _run_stages(stages)
+
+        summary.success = session.success_count
+        summary.failure += session.failure_count
+        summary.up_to_date = session.up_to_date
+        return summary
+    finally:
+        notify(progress.FINISHED)
+        sys.stdout, sys.stderr = stdout, stderr
+        latex_pool.shutdown(wait=True)
+        work_pool.shutdown(wait=True)
+        report_compiler.cleanup_scratch()
+        if manifest is not None:
+            manifest.save()
+
+async def _run_stages(stages):
+    """Runs the stages together. If one fails, the others are cancelled and the error raised."""
+    running = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_EXCEPTION)
+        for stage in done:
+            stage.result()
+        await asyncio.gather(*running)
+    finally:
+        for stage in running:
+            stage.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+# --- STAGES ---
+
+def _traced(name, function, *args):
+    """Calls function(*args) in a tracing span (in the worker thread running it)."""
+    with tracing.span(name, 'load'):
+        return function(*args)
+
+def _job_key(job):
+    """A join job's report key (see report_compiler._report_key)."""
+    record_dict, _, patient_panel, result_sheet_name = job
+    return f"{result_sheet_name}/{report_compiler._report_names(record_dict, patient_panel)[2]}.pdf"
+
+async def _produce(report_jobs, chunks, notify):
+    """Hands the joined jobs on in chunks of config.PIPELINE_CHUNK_SIZE."""
+    size = max(1, config.PIPELINE_CHUNK_SIZE)
+    for start in range(0, len(report_jobs), size):
+        chunk = report_jobs[start:start + size]
+        await chunks.put(chunk)
+        for job in chunk:
+            notify(progress.QUEUED, _job_key(job))
+    await chunks.put(_DONE)
+
+def _render_chunk(chunk, output_folder):
+    """Validates and renders one chunk of jobs. Returns (compile tasks, problems)."""
+    records = [job[0] for job in chunk]
+    with tracing.span('validate', 'render', records=len(records)):
+        validation_warnings, problems = report_compiler.validate_records(records)
+    with tracing.span('render_valsets', 'render', records=len(records)):
+        valset_strings = report_compiler.generate_valset_strings(records)
+    tasks = [
+        (record_dict, template_path, output_folder, patient_panel, result_sheet_name, valset_strings[i], validation_warnings[i])
+        for i, (record_dict, template_path, patient_panel, result_sheet_name) in enumerate(chunk)
+    ]
+    return tasks, problems
+
+async def _render(loop, work_pool, chunks, tasks, output_folder, summary, notify):
+    """Turns chunks of jobs into compile tasks; writes the validation report at the end."""
+    problems = []
+    while True:
+        chunk = await chunks.get()
+        if chunk is _DONE:
+            break
+        chunk_tasks, chunk_problems = await loop.run_in_executor(work_pool, _render_chunk, chunk, output_folder)
+        problems.extend(chunk_problems)
+        for task in chunk_tasks:
+            notify(progress.RENDERED, report_compiler._report_key(task))
+            await tasks.put(task)
+    await tasks.put(_DONE)
+
+    summary.problems = len(problems)
+    summary.validation_report = await loop.run_in_executor(
+        work_pool, report_compiler.write_validation_report, problems, output_folder
+    )
+    if problems:
+        print(f"  > ❗ WARNING: {len(problems)} data problems found. See {summary.validation_report}")
+
+async def _compile(loop, latex_pool, tasks, finished, session, shared_keys, jobs, batch_size, separator, local, notify):
+    """
+    Compiles tasks as they arrive, jobs units at a time. Reports of the same
+    template and result sheet are packed into batches of batch_size; the
+    reports writing one output file (shared_keys: report key -> how many)
+    are held until the last arrives, then compiled together in run order,
+    so the PDF and the build manifest end with the last. Passes every report
+    on to the archive stage as (task, True) once its PDF is ready, compiled
+    or already up to date, or as (task, False) once it has failed for good.
+    """
+    slots = asyncio.Semaphore(jobs)
+    output_locks = {}  # report key -> lock, so one output file is never built twice at once
+    batches = {}       # (template, folder, sheet) -> tasks waiting for a full batch
+    held = {}          # report key -> tasks sharing its output file, until the last arrives
+    running = []
+
+    async def run_unit(unit_tasks, batched):
+        # Holds a slot from start(): a report key may still be locked by an earlier unit
+        try:
+            keys = sorted(set(report_compiler._report_key(task) for task in unit_tasks))
+            locks = [output_locks.setdefault(key, asyncio.Lock()) for key in keys]
+            for lock in locks:
+                await lock.acquire()
+            for key in keys:
+                notify(progress.COMPILE_STARTED, key)
+            try:
+                results, output = await loop.run_in_executor(
+                    latex_pool, report_compiler._compile_unit_captured, unit_tasks, batched, separator, local
+                )
+            finally:
+                for lock in locks:
+                    lock.release()
+        finally:
+            slots.release()
+        report_compiler._replay_output(output)
+        retrying = len(session.retry_queue)
+        session.tally(unit_tasks, results)
+        retried = set(id(task) for task in session.retry_queue[retrying:])
+        for task, ok in zip(unit_tasks, results):
+            if id(task) in retried:
+                continue
+            key = report_compiler._report_key(task)
+            if ok:
+                notify(progress.COMPILE_FINISHED, key)
+            else:
+                notify(progress.FAILED, key, reason=report_compiler.failure_reason(key))
+            await finished.put((task, ok))
+
+    async def start(unit_tasks, batched):
+        # Waiting for a free slot here is what holds the render stage back
+        await slots.acquire()
+        running.append(asyncio.ensure_future(run_unit(unit_tasks, batched)))
+
+    try:
+        while True:
+            task = await tasks.get()
+            if task is _DONE:
+                break
+            key = report_compiler._report_key(task)
+            group = [task]
+            if key in shared_keys:
+                group = held.setdefault(key, [])
+                group.append(task)
+                if len(group) < shared_keys[key]:
+                    continue
+                del held[key]
+            stale = session.admit(group)
+            stale_ids = set(id(task) for task in stale)
+            for task in group:
+                if id(task) in stale_ids:
+                    continue
+                if session.template_broken(task[1]):
+                    notify(progress.FAILED, key, reason=report_compiler.failure_reason(key))
+                    await finished.put((task, False))
+                else:
+                    notify(progress.COMPILE_FINISHED, key, up_to_date=True)
+                    await finished.put((task, True))
+            if len(stale) > 1:
+                # One output file: compiled one after another, never batched
+                await start(stale, False)
+                continue
+            for task in stale:
+                if batch_size <= 1:
+                    await start([task], False)
+                    continue
+                batch_key = (task[1], task[2], task[4])
+                batch = batches.setdefault(batch_key, [])
+                batch.append(task)
+                if len(batch) >= batch_size:
+                    del batches[batch_key]
+                    await start(batch, True)
+        for batch in list(batches.values()):
+            await start(batch, len(batch) > 1)
+        await asyncio.gather(*running)
+
+        retry = session.take_retries()
+        while retry:
+            del running[:]
+            for task in retry:
+                await start([task], False)
+            await asyncio.gather(*running)
+            retry = session.take_retries()
+    finally:
+        for unit in running:
+            unit.cancel()
+    await finished.put(_DONE)
+
+    if session.up_to_date:
+        print(f"INFO: {session.up_to_date} reports were already up to date.")
+
+async def _archive(loop, finished, settled, output_folder, archive_folder, zip_bundles, summary, notify):
+    """
+    Archives each finished report's PDF as it arrives, config.ARCHIVE_WORKERS
+    at a time, and hands every report on to the bundle stage (settled), if any.
+    """
+    if not archive_folder:
+        while True:
+            item = await finished.get()
+            if settled is not None:
+                await settled.put(item)
+            if item is _DONE:
+                return
+
+    print(f"INFO: Archiving files to: {archive_folder}")
+    workers = max(1, config.ARCHIVE_WORKERS)
+    archive = archiver.Archiver(output_folder, archive_folder, zip_bundles=zip_bundles)
+    io_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='xg-archive')
+    slots = asyncio.Semaphore(workers)
+    pending = []
+    complete = False
+
+    async def publish(relative_path):
+        try:
+            await loop.run_in_executor(io_pool, archive.publish, relative_path)
+            summary.archived += 1
+            notify(progress.ARCHIVED, relative_path)
+        except OSError as e:
+            print(f"  > WARNING: Could not archive {relative_path}. {e}", file=sys.stderr)
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            item = await finished.get()
+            if item is _DONE:
+                break
+            task, ok = item
+            if ok:
+                await slots.acquire()
+                pending.append(asyncio.ensure_future(publish(report_compiler._report_key(task))))
+            if settled is not None:
+                await settled.put(item)
+        if settled is not None:
+            await settled.put(_DONE)
+        await asyncio.gather(*pending)
+        complete = True
+    finally:
+        for publishing in pending:
+            publishing.cancel()
+        io_pool.shutdown(wait=True)
+        # A stopped run leaves no half-filled zip bundles behind
+        await loop.run_in_executor(None, archive.close, not complete)
+
+async def _bundle(loop, settled, bundles, summary):
+    """Writes each bundle (see bundler.Bundler) as soon as the last of its reports is done."""
+    io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='xg-bundle')
+    pending = []
+
+    async def write(group):
+        try:
+            await loop.run_in_executor(io_pool, bundles.write, group)
+        except OSError as e:
+            print(f"  > WARNING: Could not write the bundle for {'/'.join(group)}. {e}", file=sys.stderr)
+
+    try:
+        while True:
+            item = await settled.get()
+            if item is _DONE:
+                break
+            task, ok = item
+            for group in bundles.settle(report_compiler._report_key(task), ok):
+                pending.append(asyncio.ensure_future(write(group)))
+        await asyncio.gather(*pending)
+    finally:
+        for writing in pending:
+            writing.cancel()
+        io_pool.shutdown(wait=True)
+    summary.bundles = bundles.written
+    if bundles.written:
+        print(f"INFO: Wrote {bundles.written} bundles to {bundles.bundle_folder}")
@@ -0,0 +1,188 @@
+import sys
+import time
+import threading
+import collections
+
+# --- PROGRESS EVENTS ---
+# pipeline.run_pipeline() reports what happens to each report by calling its
+# progress callback with a ProgressEvent. Events come from the pipeline's
+# event loop thread, in order:
+#
+#   STARTED            once, with the number of reports (count)
+#   QUEUED, RENDERED   per report, as it goes through the render stage
+#   COMPILE_STARTED    per report, when its pdflatex job starts
+#   COMPILE_FINISHED   per report with a PDF (up_to_date when it was skipped)
+#   FAILED             per report that won't get a PDF (reason as in
+#                      report_compiler.failure_summary())
+#   ARCHIVED           per PDF published to the archive folder
+#   FINISHED           once, at the end of the run
+STARTED = 'started'
+QUEUED = 'queued'
+RENDERED = 'rendered'
+COMPILE_STARTED = 'compile_started'
+COMPILE_FINISHED = 'compile_finished'
+FAILED = 'failed'
+ARCHIVED = 'archived'
+FINISHED = 'finished'
+
+class ProgressEvent(object):
+    """One progress event. report is the report's PDF path relative to the output folder."""
+    __slots__ = ('kind', 'report', 'count', 'reason', 'up_to_date', 'time')
+
+    def __init__(self, kind, report=None, count=None, reason=None, up_to_date=False):
+        self.kind = kind
+        self.report = report
+        self.count = count
+        self.reason = reason
+        self.up_to_date = up_to_date
+        self.time = time.monotonic()
+
+# Compile rate is measured over the reports finished in the last this many seconds
+RATE_WINDOW = 60.0
+
+class ProgressTracker(object):
+    """
+    Progress callback that keeps counts, the compile rate and an ETA.
+    Safe to read from another thread (e.g. a GUI timer) while a run goes on.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.rendered = 0
+        self.compiled = 0
+        self.up_to_date = 0
+        self.failed = 0
+        self.archived = 0
+        self.finished = False
+        self._started_at = None
+        self._recent = collections.deque() # times reports finished compiling
+
+    def __call__(self, event):
+        with self._lock:
+            kind = event.kind
+            if kind == STARTED:
+                self.total = event.count
+                self._started_at = event.time
+            elif kind == RENDERED:
+                self.rendered += 1
+            elif kind == COMPILE_FINISHED:
+                if event.up_to_date:
+                    self.up_to_date += 1
+                else:
+                    self.compiled += 1
+                    self._recent.append(event.time)
+            elif kind == FAILED:
+                self.failed += 1
+                self._recent.append(event.time)
+            elif kind == ARCHIVED:
+                self.archived += 1
+            elif kind == FINISHED:
+                self.finished = True
+
+    @property
+    def done(self):
+        """Reports with a final outcome: compiled, up to date or failed."""
+        return self.compiled + self.up_to_date + self.failed
+
+    def rate_per_minute(self):
+        """Reports compiled (or failed) per minute, recently. None before the first one."""
+        with self._lock:
+            if not self._recent:
+                return None
+            now = time.monotonic()
+            while len(self._recent) > 1 and now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+            span = min(RATE_WINDOW, now - self._started_at)
+            return 60.0 * len(self._recent) / span if span > 0 else None
+
+    def eta_seconds(self):
+        """Estimated seconds until every report is done, or None when unknown."""
+        rate = self.rate_per_minute()
+        if not rate:
+            return None
+        return 60.0 * max(0, self.total - self.done) / rate
+
+    def status_line(self):
+        """e.g. '37/120 reports (2 failed) | 41.5/min | ETA 2m00s'"""
+        line = f"{self.done}/{self.total} reports"
+        if self.failed:
+            line += f" ({self.failed} failed)"
+        rate = self.rate_per_minute()
+        if rate is not None:
+            line += f" | {rate:.1f}/min"
+        eta = self.eta_seconds()
+        if eta is not None and not self.finished:
+            line += f" | ETA {format_duration(eta)}"
+        return line
+
+def format_duration(seconds):
+    """e.g. 42s, 2m05s, 1h03m"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+class TerminalProgress(object):
+    """
+    A one-line progress display at the bottom of a terminal.
+
+    Pass it as the progress callback, and install writer(sys.stdout) and
+    writer(sys.stderr) for the run: log lines are then printed above the
+    progress line, which is redrawn at most every interval seconds.
+    """
+    def __init__(self, stream=None, interval=0.2):
+        self.stream = stream or sys.stdout
+        self.tracker = ProgressTracker()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._shown = False
+        self._drawn_at = 0.0
+        self._at_line_start = True
+
+    def __call__(self, event):
+        self.tracker(event)
+        with self._lock:
+            if event.kind == FINISHED:
+                self._clear()
+            elif self._at_line_start and event.time - self._drawn_at >= self.interval:
+                self._draw()
+
+    def writer(self, stream):
+        """A stand-in for sys.stdout/sys.stderr that prints above the progress line."""
+        return _ProgressWriter(self, stream)
+
+    def _write(self, stream, text):
+        with self._lock:
+            self._clear()
+            stream.write(text)
+            if stream is not self.stream:
+                stream.flush()
+            self._at_line_start = text.endswith('\n')
+            if self._at_line_start and not self.tracker.finished and time.monotonic() - self._drawn_at >= self.interval:
+                self._draw()
+
+    def _draw(self):
+        if self.tracker.total:
+            self.stream.write(f"\r[{self.tracker.status_line()}]")
+            self.stream.flush()
+            self._shown = True
+            self._drawn_at = time.monotonic()
+
+    def _clear(self):
+        if self._shown:
+            self.stream.write("\r\033[K")
+            self._shown = False
+
+class _ProgressWriter(object):
+    def __init__(self, progress, stream):
+        self._progress = progress
+        self._stream = stream
+
+    def write(self, text):
+        if text:
+            self._progress._write(self._stream, text)
+
+    def flush(self):
+        self._stream.flush()
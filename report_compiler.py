@@ -1,12 +1,36 @@
 import subprocess
 import os
+import csv
+import json
 import pandas as pd
 import sys
 import re 
+import hashlib
+import threading
+import shutil
+import tempfile
+import time
+import signal
 import config 
+import report_rules
+import tracing
 from datetime import datetime
 
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    # Batch compilation needs pypdf to split the combined PDF; without it
+    # every report is compiled in its own pdflatex job.
+    PdfReader = PdfWriter = None
+
+# Set lookups for the per-column classification in _render_column
+_TEXT_FIELDS = set(config.TEXT_FIELDS)
+_DATE_FIELDS = set(config.DATE_FIELDS)
+
 # --- CONFIGURATION ---
+# Log messages meaning another pdflatex run is needed to settle references
+LATEX_RERUN_PATTERN = re.compile(r"Rerun (?:LaTeX|to get)|Label\(s\) may have changed|Table widths have changed")
+
 # Use a list of tuples to GUARANTEE replacement order.
 # Backslash MUST be escaped first to solve the \textbackslash{} bug.
 LATEX_SPECIAL_CHARS = [
@@ -22,6 +46,25 @@ LATEX_SPECIAL_CHARS = [
     ('^', r'\textasciicircum{}'),
 ]
 
+def _escape_char_sequentially(char):
+    """Runs one character through the LATEX_SPECIAL_CHARS replacements, in order."""
+    for special_char, escaped_char in LATEX_SPECIAL_CHARS:
+        char = char.replace(special_char, escaped_char)
+    return char
+
+# Every replacement above maps a single character to a string, so chaining them
+# is the same as mapping each character once. Building the table from the chain
+# keeps its exact output (a backslash still ends up as \textbackslash\{\})
+# while escaping a value in a single str.translate pass.
+_LATEX_ESCAPE_TABLE = str.maketrans({
+    special_char: _escape_char_sequentially(special_char)
+    for special_char, _ in LATEX_SPECIAL_CHARS
+})
+
+def _escape_latex(text):
+    """Escapes LaTeX special characters in a single pass."""
+    return text.translate(_LATEX_ESCAPE_TABLE)
+
 def _sanitize_for_filename(text_string):
     """
     Removes spaces, slashes, and other risky characters for a filename.
@@ -82,131 +125,1024 @@ def _validate_record_integrity(report_data):
         for w in warnings:
             print(w)
 
-def generate_valset_string(report_data):
+def _parse_date_column(values):
     """
-    Creates the LaTeX \ValSet string from a dictionary of data
-    with improved sanitization, date formatting, and NaN handling.
+    Parses a whole column of dates at once; unparseable values become NaT.
+    Timezone-aware values are converted to UTC and made naive, so the column
+    compares with datetime.now().
     """
-    definitions = []
-    
-    # --- LOGIC: Conditional ReportDate ---
-    # If the ReportDate is missing in the Excel file, default to Today.
-    current_date_val = report_data.get('ReportDate')
-    is_empty = pd.isna(current_date_val) or (isinstance(current_date_val, str) and not current_date_val.strip())
+    try:
+        return pd.to_datetime(values, errors='coerce', format='mixed', utc=True).dt.tz_convert(None)
+    except (TypeError, ValueError):
+        # e.g. a value to_datetime can't handle in a column: fall back to one at a time
+        def parse(val):
+            try:
+                date_val = pd.Timestamp(val)
+            except Exception:
+                return pd.NaT
+            if date_val is not pd.NaT and date_val.tzinfo is not None:
+                date_val = date_val.tz_convert(None)
+            return date_val
+        return pd.to_datetime(pd.Series([parse(v) for v in values], index=values.index, dtype=object))
 
-    if is_empty:
-        report_data['ReportDate'] = datetime.now()
+def validate_records(records):
+    """
+    Runs the _validate_record_integrity checks column-wise over a whole batch,
+    before any compilation starts.
+    Returns (warnings, problems): warnings holds, per record, the messages
+    _validate_record_integrity would print; problems holds one dict per issue
+    (Barcode, TestID, Field, Problem, Value) for write_validation_report().
+    """
+    frame = pd.DataFrame.from_records(records)
+    warnings = [[] for _ in records]
+    issues = [[] for _ in records]
+    today = datetime.now()
+
+    def column(field):
+        if field in frame.columns:
+            return frame[field]
+        return pd.Series([None] * len(frame), index=frame.index, dtype=object)
+
+    def is_blank(values):
+        return values.isna() | (values.astype(str).str.strip() == '')
+
+    # 1. Check Dates (Future Check), parsing each column once
+    for field in config.DATE_FIELDS:
+        values = column(field)
+        present = ~is_blank(values)
+        if not present.any():
+            continue
+        parsed = _parse_date_column(values[present])
+        for position in parsed.index[(parsed > today).to_numpy(dtype=bool)]:
+            date_val = parsed[position]
+            warnings[position].append(f"  > ❗ WARNING: Future date detected in '{field}': {date_val.strftime('%m/%d/%Y')}")
+            issues[position].append((field, 'Future date', date_val.strftime('%m/%d/%Y')))
+
+    # 2. Check Missing Values (Required Text Fields, except the auto-filled ReportDate)
+    for field in config.TEXT_FIELDS:
+        if field == 'ReportDate':
+            continue
+        for position in frame.index[is_blank(column(field)).to_numpy()]:
+            warnings[position].append(f"  > ❗ WARNING: Missing value for variable '{field}'")
+            issues[position].append((field, 'Missing value', ''))
+
+    problems = []
+    for report_data, record_issues in zip(records, issues):
+        for field, problem, value in record_issues:
+            problems.append({
+                'Barcode': report_data.get('Barcode', ''),
+                'TestID': report_data.get('TestID', ''),
+                'Field': field,
+                'Problem': problem,
+                'Value': value,
+            })
+    return warnings, problems
+
+def write_validation_report(problems, output_folder):
+    """
+    Writes the pre-batch validation problems to <output_folder>/validation_report.csv
+    (one row per problem) and .json (problems grouped by barcode).
+    Returns the CSV path.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    base_path = os.path.join(output_folder, config.VALIDATION_REPORT_NAME)
+
+    columns = ['Barcode', 'TestID', 'Field', 'Problem', 'Value']
+    with open(f"{base_path}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for problem in problems:
+            writer.writerow({k: '' if pd.isna(problem[k]) else problem[k] for k in columns})
+
+    by_barcode = {}
+    for problem in problems:
+        barcode = '' if pd.isna(problem['Barcode']) else str(problem['Barcode'])
+        by_barcode.setdefault(barcode, []).append({
+            'TestID': '' if pd.isna(problem['TestID']) else str(problem['TestID']),
+            'Field': problem['Field'],
+            'Problem': problem['Problem'],
+            'Value': problem['Value'],
+        })
+    with open(f"{base_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(by_barcode, f, indent=2)
+
+    return f"{base_path}.csv"
+
+def _render_column(key, values):
+    """
+    Renders one column of values to their sanitized \\ValSet text.
+    The column is classified once (text, date, lab result) instead of per value.
+    """
+    is_text = key in _TEXT_FIELDS
+    is_date = key in _DATE_FIELDS
+    empty_value = '' if is_text else '0'  # '0' for lab results prevents a LaTeX crash
+
+    rendered = []
+    memo = {}
+    for value in values:
+        # 1. Handle Empty Values (NaN OR an empty string after stripping whitespace)
+        if pd.isna(value):
+            rendered.append(empty_value)
+            continue
+
+        # Repeated values (e.g. 'Pending', 0, a shared physician) are rendered once.
+        # The type is part of the key so 1, 1.0 and True stay distinct.
+        memo_key = (type(value), value)
+        try:
+            str_value = memo.get(memo_key)
+        except TypeError:
+            memo_key, str_value = None, None
+        if str_value is not None:
+            rendered.append(str_value)
+            continue
+
+        if str(value).strip() == "":
+            str_value = empty_value
 
-    for key, value in report_data.items():
-        
-        # --- LOGIC: Robust Empty Check ---
-        # Check if value is NaN OR an empty string (after stripping whitespace)
-        is_val_empty = pd.isna(value) or (str(value).strip() == "")
-        
-        # 1. Handle Empty Values
-        if is_val_empty:
-            if key in config.TEXT_FIELDS:
-                str_value = ''  # Empty string for text/info fields
-            else:
-                str_value = '0' # '0' for all other (lab result) fields (prevents LaTeX crash)
-        
         # 2. Handle Existing Values
+        elif is_date and isinstance(value, (datetime, pd.Timestamp)):
+            str_value = value.strftime('%m/%d/%Y')  # Format as MM/DD/YYYY
         else:
-            # --- Check for date formatting ---
-            if key in config.DATE_FIELDS and isinstance(value, (datetime, pd.Timestamp)):
-                # Format as MM/DD/YYYY
-                str_value = value.strftime('%m/%d/%Y')
-            else:
-                # Just convert to string as before
-                str_value = str(value)
-        
+            str_value = str(value)
+
         # 3. Apply LaTeX sanitization
-        if key in config.TEXT_FIELDS:
+        if is_text:
             # This is a known text field, sanitize it.
-            for char, escaped_char in LATEX_SPECIAL_CHARS:
-                str_value = str_value.replace(char, escaped_char)
+            str_value = _escape_latex(str_value)
         else:
-            # --- Handle non-numeric lab results ---
-            # This is a lab result. Only sanitize if it's not a pure number.
+            # This is a lab result. Only sanitize if it's not a pure number
+            # (e.g., 'Detected', '10^5', 'Pending' must be escaped).
             try:
-                # Try to convert to float. If it works, it's a number.
                 float(str_value)
-                # It's a number, do not sanitize.
             except ValueError:
-                # It's not a number (e.g., 'Detected', '10^5', 'Pending')
-                # We MUST sanitize it so chars like '^' don't break LaTeX.
-                for char, escaped_char in LATEX_SPECIAL_CHARS:
-                    str_value = str_value.replace(char, escaped_char)
+                str_value = _escape_latex(str_value)
 
-        definitions.append(f"\\ValSet{{{key}}}{{{str_value}}}")
-        
-    return "\n".join(definitions)
+        if memo_key is not None:
+            memo[memo_key] = str_value
+        rendered.append(str_value)
+    return rendered
 
-def compile_single_report(report_data, template_path, base_output_folder, panel_name, result_sheet_name):
+def generate_valset_strings(records):
     """
-    Generates and compiles a single LaTeX report.
+    Creates the LaTeX \\ValSet strings for many records (e.g. a whole sheet) at once.
+    Records sharing the same keys are rendered column by column. Returns the
+    strings in the same order as the records, identical to generate_valset_string().
+    Each lab result is followed by its \\ValRules line (see report_rules.py).
     """
-    
-    # --- 1. Create New Filename ---
+    # --- LOGIC: Conditional ReportDate ---
+    # If the ReportDate is missing in the Excel file, default to Today.
+    now = datetime.now()
+    for report_data in records:
+        current_date_val = report_data.get('ReportDate')
+        is_empty = pd.isna(current_date_val) or (isinstance(current_date_val, str) and not current_date_val.strip())
+        if is_empty:
+            report_data['ReportDate'] = now
+
+    # Group records by their column layout (one group per result sheet)
+    groups = {}
+    for index, report_data in enumerate(records):
+        groups.setdefault(tuple(report_data), []).append(index)
+
+    valset_strings = [None] * len(records)
+    for keys, indices in groups.items():
+        columns = [
+            _render_column(key, [records[i][key] for i in indices])
+            for key in keys
+        ]
+        prefixes = [f"\\ValSet{{{key}}}{{" for key in keys]
+        # Lab results also carry their precomputed result/XA/tag (\\ValRules)
+        rules_columns = [
+            report_rules.render_rules_column(key, column)
+            if config.PRECOMPUTE_RULES and key not in _TEXT_FIELDS else None
+            for key, column in zip(keys, columns)
+        ]
+        for row, index in enumerate(indices):
+            lines = []
+            for prefix, column, rules in zip(prefixes, columns, rules_columns):
+                lines.append(f"{prefix}{column[row]}}}")
+                if rules is not None and rules[row]:
+                    lines.append(rules[row])
+            valset_strings[index] = "\n".join(lines)
+    return valset_strings
+
+def _template_valset(template_path, valset_string):
+    """
+    The \\ValSet block as written for template_path: without its \\ValRules
+    lines unless the template passed report_rules.check_templates().
+    """
+    if report_rules.rules_verified(template_path):
+        return valset_string
+    return "\n".join(line for line in valset_string.split("\n") if not line.startswith("\\ValRules{"))
+
+def generate_valset_string(report_data):
+    """
+    Creates the LaTeX \\ValSet string from a dictionary of data
+    with improved sanitization, date formatting, and NaN handling.
+    """
+    return generate_valset_strings([report_data])[0]
+
+# --- TEMPLATE REGISTRY ---
+# Each template is read once and kept split at the insertion point, so a report
+# is written as prefix + ValSet block + suffix without copying the template.
+# An entry is reloaded when the file's mtime or size changes.
+DATA_INSERT_POINT = '%% -- DATA_INSERT_POINT -- %%'
+
+_templates = {}  # template_path -> (mtime_ns, size, prefix, suffix, sha256)
+_template_lock = threading.Lock()
+
+class TemplateError(Exception):
+    """A template can't be used to build reports."""
+
+def load_template(template_path):
+    """
+    Returns (prefix, suffix): the template text before and after its
+    DATA_INSERT_POINT marker. Raises TemplateError if the template can't be
+    read or has no insertion point, rather than building reports without data.
+    """
+    try:
+        stat = os.stat(template_path)
+    except OSError as e:
+        raise TemplateError(f"Cannot read template {template_path}: {e}")
+
+    with _template_lock:
+        entry = _templates.get(template_path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            return entry[2], entry[3]
+
+        try:
+            with open(template_path, 'r') as f:
+                content = f.read()
+        except OSError as e:
+            raise TemplateError(f"Cannot read template {template_path}: {e}")
+        prefix, marker, suffix = content.partition(DATA_INSERT_POINT)
+        if not marker:
+            raise TemplateError(f"Template {os.path.basename(template_path)} has no '{DATA_INSERT_POINT}' line.")
+
+        if entry is not None:
+            # The template changed: its format and .aux seed are stale too
+            _formats.pop(template_path, None)
+            _aux_seeds.pop(template_path, None)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        _templates[template_path] = (stat.st_mtime_ns, stat.st_size, prefix, suffix, digest)
+        return prefix, suffix
+
+def template_digest(template_path):
+    """sha256 of the template's current text (see load_template)."""
+    load_template(template_path)
+    with _template_lock:
+        return _templates[template_path][4]
+
+# Last stable .aux per template, used to seed a new report's first run. When the
+# report ends up with the same references (e.g. the same page count) the first
+# run is already final and the second run is skipped.
+_aux_seeds = {}
+
+def _read_file_bytes(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+# --- PRECOMPILED FORMATS ---
+# Each template's preamble (everything before \begin{document}) is dumped once
+# into a .fmt with mylatexformat. Reports compiled with -fmt skip re-loading
+# tikz, expl3, longtable, microtype... on every run. The format name carries a
+# hash of the preamble and engine version, so editing a preamble rebuilds it.
+_formats = {}  # template_path -> format name, or None when unavailable
+_format_lock = threading.Lock()
+_engine_version = None
+
+def _latex_engine_version():
+    """First line of `pdflatex --version` (formats are engine-specific)."""
+    global _engine_version
+    if _engine_version is None:
+        try:
+            process = subprocess.run(["pdflatex", "--version"], capture_output=True, text=True, errors='replace', startupinfo=_startupinfo())
+            _engine_version = (process.stdout or '').splitlines()[0] if process.stdout else ''
+        except OSError:
+            _engine_version = ''
+    return _engine_version
+
+def _startupinfo():
+    """Hides the pdflatex console window on Windows."""
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+class CompileTimeout(Exception):
+    """A pdflatex job ran past config.COMPILE_TIMEOUT and was killed."""
+
+def _kill_process_tree(process):
+    """Kills a process started by _run_process() together with everything it started."""
+    try:
+        if os.name == 'nt':
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                           capture_output=True, startupinfo=_startupinfo())
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    process.kill()
+
+def _run_process(cmd, cwd=None, env=None, timeout=None):
+    """
+    subprocess.run() for pdflatex, in its own process group with no stdin.
+    If it is still running after timeout seconds the whole group is killed
+    and CompileTimeout is raised.
+    """
+    if os.name == 'nt':
+        group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group = {'start_new_session': True}
+    process = subprocess.Popen(
+        cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, errors='replace', startupinfo=_startupinfo(), **group
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_tree(process)
+        process.communicate()
+        raise CompileTimeout(f"pdflatex did not finish within {config.COMPILE_TIMEOUT} seconds")
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def _format_env():
+    """Environment that lets pdflatex find formats in config.FORMAT_DIR (then the defaults)."""
+    env = dict(os.environ)
+    env['TEXFORMATS'] = config.FORMAT_DIR + os.pathsep + env.get('TEXFORMATS', '')
+    return env
+
+def _build_format(template_path):
+    """Dumps the template's preamble into a format. Returns its name, or None on failure."""
+    prefix, _ = load_template(template_path)
+    end = prefix.find('\\begin{document}')
+    if end == -1:
+        return None
+    preamble = prefix[:end]
+
+    digest = hashlib.sha256((preamble + _latex_engine_version()).encode('utf-8')).hexdigest()[:16]
+    template_stem = _sanitize_for_filename(os.path.splitext(os.path.basename(template_path))[0])
+    format_name = f"{template_stem}-{digest}"
+    if os.path.exists(os.path.join(config.FORMAT_DIR, f"{format_name}.fmt")):
+        return format_name
+
+    os.makedirs(config.FORMAT_DIR, exist_ok=True)
+    # Drop formats built from older versions of this preamble
+    for name in os.listdir(config.FORMAT_DIR):
+        if name.startswith(f"{template_stem}-") and not name.startswith(format_name):
+            try:
+                os.remove(os.path.join(config.FORMAT_DIR, name))
+            except OSError:
+                pass
+
+    # The preamble is written to its own file so the name has no spaces
+    with open(os.path.join(config.FORMAT_DIR, f"{format_name}.tex"), 'w') as f:
+        f.write(preamble)
+        f.write('\\begin{document}\n\\end{document}\n')
+
+    print(f"  > Building precompiled format for {os.path.basename(template_path)}")
+    cmd = [
+        "pdflatex", "-ini", "-interaction=nonstopmode",
+        f"-jobname={format_name}", "&pdflatex", "mylatexformat.ltx", f"{format_name}.tex"
+    ]
+    try:
+        with tracing.span('build_format', 'latex', template=template_path):
+            process = _run_process(cmd, cwd=config.FORMAT_DIR, timeout=config.COMPILE_TIMEOUT or None)
+    except (OSError, CompileTimeout) as e:
+        print(f"  > WARNING: Could not build precompiled format ({e}). Compiling without it.")
+        return None
+    if process.returncode != 0 or not os.path.exists(os.path.join(config.FORMAT_DIR, f"{format_name}.fmt")):
+        print(f"  > WARNING: Could not build precompiled format for {os.path.basename(template_path)}. Compiling without it.")
+        return None
+    return format_name
+
+def _template_format(template_path):
+    """Returns the format name to compile this template with, or None."""
+    if not config.USE_PRECOMPILED_FORMAT:
+        return None
+    with _format_lock:
+        if template_path not in _formats:
+            try:
+                _formats[template_path] = _build_format(template_path)
+            except (OSError, TemplateError):
+                _formats[template_path] = None
+        return _formats[template_path]
+
+def _disable_format(template_path):
+    with _format_lock:
+        _formats[template_path] = None
+
+# --- SCRATCH DIRECTORIES ---
+# pdflatex runs in a per-worker scratch directory (on tmpfs when available), so
+# only the finished PDFs reach the output tree. Each worker directory holds an
+# "assets" link and jobs run two levels below it, in <worker>/build/job/, so the
+# templates' ../../assets paths resolve as they do from output/<Result Sheet>/.
+_scratch_dirs = {}  # thread id -> worker directory
+_scratch_lock = threading.Lock()
+
+def _scratch_root():
+    """config.SCRATCH_DIR, else /dev/shm when usable, else the system temp folder."""
+    if config.SCRATCH_DIR:
+        return config.SCRATCH_DIR
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def _scratch_dir():
+    """Returns this thread's empty job directory, creating its worker directory if needed."""
+    key = threading.get_ident()
+    with _scratch_lock:
+        worker_dir = _scratch_dirs.get(key)
+        if worker_dir is None or not os.path.isdir(worker_dir):
+            root = _scratch_root()
+            os.makedirs(root, exist_ok=True)
+            worker_dir = tempfile.mkdtemp(prefix='xg-latex-', dir=root)
+            try:
+                os.symlink(config.ASSETS_DIR, os.path.join(worker_dir, 'assets'), target_is_directory=True)
+            except OSError:
+                # No symlinks (e.g. Windows without developer mode): copy the images
+                shutil.copytree(config.ASSETS_DIR, os.path.join(worker_dir, 'assets'))
+            _scratch_dirs[key] = worker_dir
+
+    job_dir = os.path.join(worker_dir, 'build', 'job')
+    os.makedirs(job_dir, exist_ok=True)
+    for name in os.listdir(job_dir):
+        os.remove(os.path.join(job_dir, name))
+    return job_dir
+
+def cleanup_scratch():
+    """Removes every worker scratch directory."""
+    with _scratch_lock:
+        for worker_dir in _scratch_dirs.values():
+            shutil.rmtree(worker_dir, ignore_errors=True)
+        _scratch_dirs.clear()
+
+def _publish(src_path, dest_folder, dest_name):
+    """
+    Moves a file from scratch into the output tree. It is copied next to its
+    destination first (scratch is often another filesystem), then renamed into
+    place, so a PDF in the output tree is always complete.
+    """
+    os.makedirs(dest_folder, exist_ok=True)
+    dest_path = os.path.join(dest_folder, dest_name)
+    tmp_path = os.path.join(dest_folder, f".{dest_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+def _keep_failure_files(job_dir, jobname, dest_folder):
+    """Copies a failed job's .log and .tex into the output tree. Returns the log path."""
+    for ext in ('.log', '.tex'):
+        src_path = os.path.join(job_dir, f"{jobname}{ext}")
+        if os.path.exists(src_path):
+            _publish(src_path, dest_folder, f"{jobname}{ext}")
+    return os.path.join(dest_folder, f"{jobname}.log")
+
+def _report_names(report_data, panel_name):
+    """Returns (test_id, patient_name, base_filename) for a report."""
     test_id = _sanitize_for_filename(report_data.get('TestID', 'UnknownTestID'))
     panel = _sanitize_for_filename(panel_name) # Use the master panel name
     fname = _sanitize_for_filename(report_data.get('PatientFirstName', 'NoFirstName'))
     lname = _sanitize_for_filename(report_data.get('PatientLastName', 'NoLastName'))
     patient_name = f"{fname}{lname}"
-    
+
     # Format: XG12345_WHP_JaneDoe_Report
     base_filename = f"{test_id}_{panel}_{patient_name}_Report"
+    return test_id, patient_name, base_filename
+
+# --- COMPILE TIMING ---
+# Per template: pdflatex jobs, and the count and seconds of draft and full runs
+_compile_stats = {}
+_stats_lock = threading.Lock()
+
+def reset_compile_stats():
+    with _stats_lock:
+        _compile_stats.clear()
+
+def _record_run(template_path, draft, seconds, new_job):
+    with _stats_lock:
+        stats = _compile_stats.setdefault(template_path, {
+            'jobs': 0, 'draft_runs': 0, 'draft_seconds': 0.0, 'full_runs': 0, 'full_seconds': 0.0,
+        })
+        if new_job:
+            stats['jobs'] += 1
+        kind = 'draft' if draft else 'full'
+        stats[f'{kind}_runs'] += 1
+        stats[f'{kind}_seconds'] += seconds
+
+def timing_summary():
+    """Lines for the run summary: per template, seconds per job and per draft/full pdflatex run."""
+    lines = []
+    with _stats_lock:
+        items = sorted(_compile_stats.items())
+    for template_path, stats in items:
+        jobs = stats['jobs'] or 1
+        total = stats['draft_seconds'] + stats['full_seconds']
+        line = f"  {os.path.splitext(os.path.basename(template_path))[0]}: {stats['jobs']} jobs, {total / jobs:.2f}s/job"
+        line += f", {(stats['draft_runs'] + stats['full_runs']) / jobs:.1f} runs/job"
+        if stats['full_runs']:
+            line += f", full run {stats['full_seconds'] / stats['full_runs']:.2f}s"
+        if stats['draft_runs']:
+            line += f", draft run {stats['draft_seconds'] / stats['draft_runs']:.2f}s"
+        lines.append(line)
+    return lines
+
+# --- FAILURE QUEUE ---
+# Why each report of the current run failed, by output file
+FAIL_TEMPLATE = 'Template error'
+FAIL_LATEX = 'LaTeX error'
+FAIL_TIMEOUT = 'Timed out'
+
+_failures = {}  # report key -> (report_data, reason)
+_failures_lock = threading.Lock()
+
+def _note_failure(report_data, panel_name, result_sheet_name, reason):
+    key = f"{result_sheet_name}/{_report_names(report_data, panel_name)[2]}.pdf"
+    with _failures_lock:
+        if reason is None:
+            _failures.pop(key, None)
+        else:
+            _failures[key] = (report_data, reason)
+
+def failure_reason(report_key):
+    """Why the report (see _report_key) failed in this run, or None."""
+    with _failures_lock:
+        return _failures.get(report_key, (None, None))[1]
+
+def failure_summary():
+    """Lines for the run summary: the barcodes (Test IDs) of failed reports, by reason."""
+    by_reason = {}
+    with _failures_lock:
+        for report_data, reason in _failures.values():
+            by_reason.setdefault(reason, []).append(
+                f"{report_data.get('Barcode', '?')} ({report_data.get('TestID', '?')})"
+            )
+    return [
+        f"  {reason} ({len(reports)}): {', '.join(sorted(reports))}"
+        for reason, reports in sorted(by_reason.items())
+    ]
+
+def _run_pdflatex(tex_path, jobname, output_folder, template_path, reports=1):
+    """
+    Runs pdflatex on tex_path inside output_folder (a scratch job directory),
+    rerunning only while the .aux changes or the log
+    asks for it (lastpage, longtable), capped at config.MAX_LATEX_RUNS.
+    Uses the template's precompiled format when one is available. A first run
+    without a starting .aux is a draft (no PDF), so the last run is always full.
+    Returns (failed_run, aux, output): failed_run is the 1-based run that
+    failed (None on success), aux the final .aux contents and output the
+    console output of the last run. Raises CompileTimeout if the job takes
+    longer than config.COMPILE_TIMEOUT seconds per report it typesets
+    (reports > 1 for a batch).
+    """
+    # Every run of the job shares one deadline
+    limit = config.COMPILE_TIMEOUT * max(1, reports) if config.COMPILE_TIMEOUT else None
+    deadline = time.monotonic() + limit if limit else None
+
+    def run(cmd, env=None):
+        timeout = None if deadline is None else max(0.1, deadline - time.monotonic())
+        # _run_process also hides the console window on Windows
+        try:
+            return _run_process(cmd, cwd=output_folder, env=env, timeout=timeout)
+        except CompileTimeout:
+            raise CompileTimeout(f"pdflatex did not finish within {limit:g} seconds") from None
+
+    # Precompiled preamble for this template (None -> a normal pdflatex run)
+    format_name = _template_format(template_path)
+
+    aux_path = os.path.join(output_folder, f"{jobname}.aux")
+    aux_before = _read_file_bytes(aux_path)
+    # Without an .aux to start from the first run can't be the last one, so it
+    # runs in draft mode: references only, no PDF (images, stream compression).
+    draft = config.DRAFT_FIRST_PASS and aux_before is None and config.MAX_LATEX_RUNS > 1
+    process = None
+    for i in range(config.MAX_LATEX_RUNS):
+        cmd = [
+            "pdflatex", 
+            "-interaction=nonstopmode", 
+            f"-jobname={jobname}", 
+            f"-output-directory={output_folder}", # Tell pdflatex where to put files
+            tex_path
+        ]
+        if draft:
+            cmd.insert(1, "-draftmode")
+        env = None
+        if format_name:
+            cmd.insert(1, f"-fmt={format_name}")
+            env = _format_env()
+        started = time.perf_counter()
+        with tracing.span('pdflatex draft' if draft else 'pdflatex', 'latex', template=template_path, run=i + 1):
+            process = run(cmd, env)
+
+            if process.returncode != 0 and format_name:
+                # The format may be unusable here (e.g. after a TeX upgrade): retry this
+                # run normally, and stop using the format if that works.
+                cmd = [part for part in cmd if not part.startswith("-fmt=")]
+                process = run(cmd)
+                if process.returncode == 0:
+                    print("  > WARNING: Precompiled format failed; compiling this template without it.")
+                    _disable_format(template_path)
+                    format_name = None
+
+        _record_run(template_path, draft, time.perf_counter() - started, i == 0)
+
+        if process.returncode != 0:
+            return i + 1, None, process.stdout
+
+        aux_after = _read_file_bytes(aux_path)
+        stable = aux_after == aux_before and not LATEX_RERUN_PATTERN.search(process.stdout or '')
+        if stable and not draft:
+            break
+        aux_before = aux_after
+        draft = False
+    else:
+        print(f"  > WARNING: References still changing after {config.MAX_LATEX_RUNS} LaTeX runs.")
+
+    return None, aux_before, process.stdout
+
+def compile_single_report(report_data, template_path, base_output_folder, panel_name, result_sheet_name, valset_string=None, validation_warnings=None):
+    """
+    Generates and compiles a single LaTeX report.
+    valset_string and validation_warnings may be passed in when they were
+    already computed for the whole batch by generate_valset_strings() and
+    validate_records().
+    """
+    with tracing.span('compile', 'report', template=template_path, sheet=result_sheet_name, report=report_data.get('TestID')):
+        return _compile_single_report(
+            report_data, template_path, base_output_folder, panel_name, result_sheet_name, valset_string, validation_warnings
+        )
+
+def _compile_single_report(report_data, template_path, base_output_folder, panel_name, result_sheet_name, valset_string, validation_warnings):
+    
+    # --- 1. Create New Filename ---
+    test_id, patient_name, base_filename = _report_names(report_data, panel_name)
 
     print(f"--- Processing: {patient_name} (Test ID: {test_id}) ---")
     
     # --- Run Integrity Checks Here ---
     # This will print warnings directly below the "Processing..." line
-    _validate_record_integrity(report_data)
+    if validation_warnings is None:
+        _validate_record_integrity(report_data)
+    else:
+        for w in validation_warnings:
+            print(w)
+
+    try:
+        template_prefix, template_suffix = load_template(template_path)
+    except TemplateError as e:
+        print(f"  > ERROR: {e}", file=sys.stderr)
+        _note_failure(report_data, panel_name, result_sheet_name, FAIL_TEMPLATE)
+        return False
 
-    # --- 2. Create New Output Subfolder ---
-    # We organize by the Result Sheet name (e.g., "WH", "UTI")
+    # --- 2. Output Subfolder ---
+    # We organize by the Result Sheet name (e.g., "WH", "UTI"). Only the PDF
+    # (or, on failure, the .log and .tex) is written there.
     panel_output_folder = os.path.join(base_output_folder, result_sheet_name)
-    if not os.path.exists(panel_output_folder):
-        os.makedirs(panel_output_folder)
+    job_dir = _scratch_dir()
 
     # 3. Prepare LaTeX content
-    valset_string = generate_valset_string(report_data)
-    with open(template_path, 'r') as f:
-        template_content = f.read()
-    final_tex_content = template_content.replace('%% -- DATA_INSERT_POINT -- %%', valset_string)
+    if valset_string is None:
+        valset_string = generate_valset_string(report_data)
+    valset_string = _template_valset(template_path, valset_string)
 
-    # 4. Save the temporary .tex file (in the new subfolder)
-    output_tex_path = os.path.join(panel_output_folder, f"{base_filename}.tex")
+    # 4. Save the temporary .tex file (in the scratch directory)
+    output_tex_path = os.path.join(job_dir, f"{base_filename}.tex")
     
-    with open(output_tex_path, 'w') as f:
-        f.write(final_tex_content)
+    with tracing.span('write_tex', 'report', template=template_path, sheet=result_sheet_name), open(output_tex_path, 'w') as f:
+        f.write(template_prefix)
+        f.write(valset_string)
+        f.write(template_suffix)
     print(f"  > Generated .tex file: {os.path.basename(output_tex_path)}")
 
-    # --- WINDOWS CONSOLE SUPPRESSION ---
-    # This ensures pdflatex doesn't pop up black windows on Windows OS
-    startupinfo = None
-    if os.name == 'nt':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-    # -----------------------------------
-
     # 5. Compile the PDF using pdflatex
-    for i in range(2):
-        cmd = [
-            "pdflatex", 
-            "-interaction=nonstopmode", 
-            f"-jobname={base_filename}", 
-            f"-output-directory={panel_output_folder}", # Tell pdflatex where to put files
-            output_tex_path
-        ]
-        # Pass startupinfo to hide the window
-        process = subprocess.run(cmd, capture_output=True, text=True, startupinfo=startupinfo)
-        
-        if process.returncode != 0:
-            print(f"  > ERROR: LaTeX compilation failed on run {i+1}.", file=sys.stderr)
-            print(f"  > See log file for details: {os.path.join(panel_output_folder, f'{base_filename}.log')}", file=sys.stderr)
-            return False
+    # Start from the template's last stable .aux
+    if template_path in _aux_seeds:
+        with open(os.path.join(job_dir, f"{base_filename}.aux"), 'wb') as f:
+            f.write(_aux_seeds[template_path])
+
+    try:
+        failed_run, aux, _ = _run_pdflatex(output_tex_path, base_filename, job_dir, template_path)
+    except CompileTimeout as e:
+        log_path = _keep_failure_files(job_dir, base_filename, panel_output_folder)
+        print(f"  > ERROR: {e}; the job was stopped.", file=sys.stderr)
+        print(f"  > See log file for details: {log_path}", file=sys.stderr)
+        _note_failure(report_data, panel_name, result_sheet_name, FAIL_TIMEOUT)
+        return False
+    if failed_run:
+        log_path = _keep_failure_files(job_dir, base_filename, panel_output_folder)
+        print(f"  > ERROR: LaTeX compilation failed on run {failed_run}.", file=sys.stderr)
+        print(f"  > See log file for details: {log_path}", file=sys.stderr)
+        _note_failure(report_data, panel_name, result_sheet_name, FAIL_LATEX)
+        return False
+    _note_failure(report_data, panel_name, result_sheet_name, None)
+
+    # 6. Publish the PDF (and drop the logs of an earlier failed attempt)
+    with tracing.span('publish', 'report', template=template_path, sheet=result_sheet_name):
+        _publish(os.path.join(job_dir, f"{base_filename}.pdf"), panel_output_folder, f"{base_filename}.pdf")
+        for ext in ('.log', '.tex'):
+            stale_path = os.path.join(panel_output_folder, f"{base_filename}{ext}")
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+
+    if aux is not None:
+        _aux_seeds[template_path] = aux
 
     # Added emoji back
     print(f"  > ✅ SUCCESS: PDF compiled") 
-    return True
\ No newline at end of file
+    return True
+
+# --- BATCH COMPILATION ---
+# Several reports of one template share a single pdflatex job. Each report runs
+# inside its own group (so its \\ValSet values and \\newcommand definitions are
+# dropped afterwards) with the page counter reset to 1. Its "Page X of Y" points
+# at its own last-page label and its page count is written to the log, so the
+# combined PDF can be split back into the usual per-report files.
+_BATCH_SETUP = r"""
+\makeatletter
+% Counters are global: a repeated \newcounter just resets the existing one
+\let\xg@newcounter\newcounter
+\renewcommand{\newcounter}[1]{\@ifundefined{c@#1}{\xg@newcounter{#1}}{\setcounter{#1}{0}}}
+\newcommand{\XGEndReport}[1]{%
+  \clearpage
+  \immediate\write\@auxout{\string\newlabel{XGLastPage-#1}{{}{\number\numexpr\value{page}-1\relax}}}%
+  \typeout{XGREPORTPAGES:#1:\number\numexpr\value{page}-1\relax}%
+}
+\makeatother
+"""
+_BATCH_PAGES_PATTERN = re.compile(r"XGREPORTPAGES:(\d+):(\d+)")
+
+def compile_report_batch(tasks):
+    """
+    Compiles several reports that share a template and result sheet in one
+    pdflatex job, then splits the combined PDF into the usual
+    {TestID}_{Panel}_{Name}_Report.pdf files using the recorded page ranges.
+    tasks are compile_single_report() argument tuples. Falls back to one job
+    per report if the batch can't be built, compiled or split.
+    Returns a list of booleans, one per task.
+    """
+    if len(tasks) < 2 or PdfReader is None:
+        return [compile_single_report(*task) for task in tasks]
+
+    _, template_path, base_output_folder, _, result_sheet_name = tasks[0][:5]
+    panel_output_folder = os.path.join(base_output_folder, result_sheet_name)
+
+    try:
+        head, suffix = load_template(template_path)
+    except TemplateError:
+        return [compile_single_report(*task) for task in tasks]
+    end_at = suffix.rfind('\\end{document}')
+    if end_at == -1:
+        return [compile_single_report(*task) for task in tasks]
+    body = suffix[:end_at]
+
+    # 1. Build the combined document
+    parts = [head, _BATCH_SETUP]
+    base_filenames = []
+    for n, task in enumerate(tasks, 1):
+        report_data, _, _, panel_name, _, valset_string, validation_warnings = (tuple(task) + (None, None))[:7]
+        test_id, patient_name, base_filename = _report_names(report_data, panel_name)
+        base_filenames.append(base_filename)
+
+        print(f"--- Processing: {patient_name} (Test ID: {test_id}) ---")
+        if validation_warnings is None:
+            _validate_record_integrity(report_data)
+        else:
+            for w in validation_warnings:
+                print(w)
+
+        if valset_string is None:
+            valset_string = generate_valset_string(report_data)
+        valset_string = _template_valset(template_path, valset_string)
+        parts.append(f"\\begingroup\\setcounter{{page}}{{1}}\n{valset_string}")
+        parts.append(body.replace('\\pageref{LastPage}', f'\\pageref{{XGLastPage-{n}}}'))
+        parts.append(f"\\XGEndReport{{{n}}}\\endgroup\n")
+    parts.append(suffix[end_at:])
+
+    digest = hashlib.sha256('|'.join(base_filenames).encode('utf-8')).hexdigest()[:10]
+    jobname = f"Batch_{_sanitize_for_filename(os.path.splitext(os.path.basename(template_path))[0])}_{digest}"
+    job_dir = _scratch_dir()
+    batch_tex_path = os.path.join(job_dir, f"{jobname}.tex")
+    with tracing.span('write_tex', 'batch', template=template_path, sheet=result_sheet_name, reports=len(tasks)), open(batch_tex_path, 'w') as f:
+        f.write(''.join(parts))
+    print(f"  > Generated batch .tex file for {len(tasks)} reports: {jobname}.tex")
+
+    # 2. Compile the whole batch
+    try:
+        with tracing.span('compile batch', 'batch', template=template_path, sheet=result_sheet_name, reports=len(tasks)):
+            failed_run, _, output = _run_pdflatex(batch_tex_path, jobname, job_dir, template_path, len(tasks))
+    except CompileTimeout:
+        # A hanging report: the per-report jobs below isolate it
+        failed_run, output = 'timeout', ''
+    batch_pdf_path = os.path.join(job_dir, f"{jobname}.pdf")
+    page_counts = {int(n): int(count) for n, count in _BATCH_PAGES_PATTERN.findall(output or '')}
+    if failed_run or len(page_counts) != len(tasks) or not os.path.exists(batch_pdf_path):
+        log_path = _keep_failure_files(job_dir, jobname, panel_output_folder)
+        print(f"  > WARNING: Batch compilation failed (see {log_path}). Compiling these reports one by one.")
+        return [compile_single_report(*task) for task in tasks]
+
+    # 3. Split the combined PDF at the recorded page ranges and publish each part
+    try:
+        with tracing.span('split batch', 'batch', template=template_path, sheet=result_sheet_name, reports=len(tasks)):
+            reader = PdfReader(batch_pdf_path)
+            if sum(page_counts.values()) != len(reader.pages):
+                raise ValueError(f"expected {sum(page_counts.values())} pages, found {len(reader.pages)}")
+            start = 0
+            for n, base_filename in enumerate(base_filenames, 1):
+                writer = PdfWriter()
+                for page in reader.pages[start:start + page_counts[n]]:
+                    writer.add_page(page)
+                start += page_counts[n]
+                part_path = os.path.join(job_dir, f"{base_filename}.pdf")
+                with open(part_path, 'wb') as f:
+                    writer.write(f)
+                _publish(part_path, panel_output_folder, f"{base_filename}.pdf")
+                print(f"  > ✅ SUCCESS: PDF compiled ({base_filename}.pdf)")
+    except Exception as e:
+        print(f"  > WARNING: Could not split the batch PDF ({e}). Compiling these reports one by one.")
+        return [compile_single_report(*task) for task in tasks]
+
+    return [True] * len(tasks)
+
+# --- PARALLEL COMPILATION ---
+
+class _ThreadOutput(object):
+    """
+    Stands in for sys.stdout/sys.stderr while the worker pool runs.
+    A worker that is capturing writes into its own buffer, so each report's
+    lines can be printed together once it finishes; other writes pass through.
+    The buffer notes which stream each piece was written to, so
+    _replay_output() puts stdout and stderr lines back on their own streams.
+    """
+    def __init__(self, stream, local):
+        self._stream = stream
+        self._local = local
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            return self._stream.write(text)
+        if buffer and buffer[-1][0] is self._stream:
+            buffer[-1][1].append(text)
+        else:
+            buffer.append((self._stream, [text]))
+        return len(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._stream.flush()
+
+def _replay_output(output):
+    """Prints a worker's captured output (see _compile_unit_captured) to the streams it was written to."""
+    for stream, pieces in output:
+        # Line by line, so the GUI still colors each line on its own
+        for line in ''.join(pieces).splitlines(keepends=True):
+            stream.write(line)
+
+def _compile_unit(tasks, batched, separator):
+    """
+    Compiles one unit of work: a batch sharing a pdflatex job, or reports that
+    share an output file compiled one after another. Returns a list of booleans.
+    """
+    if batched:
+        results = compile_report_batch(tasks)
+        if separator:
+            print(separator)
+        return results
+
+    results = []
+    for task in tasks:
+        results.append(compile_single_report(*task))
+        if separator:
+            print(separator)
+    return results
+
+def _compile_unit_captured(tasks, batched, separator, local):
+    """
+    Runs _compile_unit() in a worker thread, capturing its output.
+    Returns (results, output); pass output to _replay_output().
+    """
+    local.buffer = []
+    try:
+        results = _compile_unit(tasks, batched, separator)
+    except Exception as e:
+        print(f"  > ERROR: Unexpected failure while compiling. {e}", file=sys.stderr)
+        results = [False] * len(tasks)
+    output = local.buffer
+    local.buffer = None
+    return results, output
+
+def _report_key(task):
+    """Build manifest key of a task: its PDF path relative to the output folder."""
+    report_data, _, _, panel_name, result_sheet_name = task[:5]
+    return f"{result_sheet_name}/{_report_names(report_data, panel_name)[2]}.pdf"
+
+def _report_input_hash(task):
+    """Hash of everything a report's PDF is built from: template text and \\ValSet block."""
+    report_data, template_path = task[:2]
+    valset_string = task[5] if len(task) > 5 and task[5] is not None else generate_valset_string(report_data)
+    valset_string = _template_valset(template_path, valset_string)
+    return hashlib.sha256(f"{template_digest(template_path)}\n{valset_string}".encode('utf-8')).hexdigest()
+
+class CompileSession(object):
+    """
+    Bookkeeping for one run's reports, fed in by pipeline.py as records are
+    rendered: template checks, skipping up-to-date reports (build manifest),
+    success/failure counts and the queue of timed-out reports to retry.
+    """
+    def __init__(self, manifest=None):
+        self.manifest = manifest
+        self.success_count = 0
+        self.failure_count = 0
+        self.up_to_date = 0
+        # Timed-out reports are retried, one per job, up to config.COMPILE_RETRIES
+        # more times (see take_retries()). Other failures are final.
+        self.retry_queue = []
+        self._attempt = 0
+        self._last_attempt = not config.COMPILE_RETRIES
+        self._input_hashes = {}  # id(task) -> input hash, for the manifest
+        self._last_tasks = {}    # report key -> id() of the last task writing it
+        self._broken_templates = {}  # template_path -> True if unusable
+        with _failures_lock:
+            _failures.clear()
+
+    def admit(self, tasks):
+        """
+        Returns the tasks that need compiling. Reports for a broken template
+        fail here; reports already built from the same inputs are skipped
+        (and counted as successes). Reports sharing an output file are judged
+        by the last one, which is what the PDF holds, so they must be admitted
+        together and compiled in order.
+        """
+        usable = []
+        for task in tasks:
+            template_path = task[1]
+            if template_path not in self._broken_templates:
+                # Check each template once: reports for a broken template fail here
+                try:
+                    load_template(template_path)
+                    self._broken_templates[template_path] = False
+                except TemplateError as e:
+                    print(f"  > ERROR: {e}", file=sys.stderr)
+                    self._broken_templates[template_path] = True
+            if self._broken_templates[template_path]:
+                _note_failure(task[0], task[3], task[4], FAIL_TEMPLATE)
+                self.failure_count += 1
+            else:
+                usable.append(task)
+
+        keys = [_report_key(task) for task in usable]
+        for key, task in zip(keys, usable):
+            self._last_tasks[key] = id(task)
+        if self.manifest is None:
+            return usable
+        last_hashes = {}
+        for key, task in zip(keys, usable):
+            self._input_hashes[id(task)] = last_hashes[key] = _report_input_hash(task)
+        stale = [task for key, task in zip(keys, usable) if not self.manifest.is_current(key, last_hashes[key])]
+        self.up_to_date += len(usable) - len(stale)
+        self.success_count += len(usable) - len(stale)
+        return stale
+
+    def tally(self, unit_tasks, results):
+        """
+        Counts a finished unit's results and records them in the manifest.
+        Only the last report writing an output file is retried or recorded:
+        its PDF is what the file holds.
+        """
+        for task, ok in zip(unit_tasks, results):
+            key = _report_key(task)
+            last = self._last_tasks.get(key) == id(task)
+            if not ok and not self._last_attempt and last:
+                with _failures_lock:
+                    timed_out = _failures.get(key, (None, None))[1] == FAIL_TIMEOUT
+                if timed_out:
+                    self.retry_queue.append(task)
+                    continue
+            if ok:
+                self.success_count += 1
+            else:
+                self.failure_count += 1
+            if self.manifest is not None and last:
+                if ok:
+                    self.manifest.record(key, self._input_hashes[id(task)])
+                else:
+                    self.manifest.forget(key)
+
+    def template_broken(self, template_path):
+        """True if admit() failed the template's reports (see TemplateError)."""
+        return self._broken_templates.get(template_path, False)
+
+    def take_retries(self):
+        """Starts the next retry attempt: returns the timed-out tasks to compile again, or []."""
+        attempts = 1 + max(0, config.COMPILE_RETRIES or 0)
+        if not self.retry_queue or self._attempt + 1 >= attempts:
+            return []
+        self._attempt += 1
+        self._last_attempt = self._attempt == attempts - 1
+        tasks = list(self.retry_queue)
+        del self.retry_queue[:]
+        print(f"INFO: Retrying {len(tasks)} timed-out reports (attempt {self._attempt + 1} of {attempts}).")
+        return tasks
@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import glob
+import json
+import decimal
+import hashlib
+import argparse
+import threading
+import subprocess
+import config
+
+# --- RESULT RULES ---
+# The decisions the templates used to make in LaTeX3 fp code for every pathogen
+# row (\ResultOf, \XAOf, \XATagOf, \DescOf), made once per value in Python and
+# passed to the template as \ValRules{name}{result}{XA}{tag}:
+#   result  D = Detected (0 < Ct < 35), T = Not tested (Ct = -1), N = Not detected
+#   XA      35 - Ct when detected, else empty
+#   tag     H = High (Ct <= 25), M = Moderate (<= 30), L = Low (< 35), else empty
+# The description is printed only for detected results.
+DETECTED, NOT_DETECTED, NOT_TESTED = 'D', 'N', 'T'
+HIGH, MODERATE, LOW = 'H', 'M', 'L'
+
+# Only plain decimals get precomputed values. Anything else (e.g. 1e-05 or an
+# escaped 'Pending') is left to the template's own macros, as before.
+_NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)\Z")
+
+# l3fp works with 16 significant digits, rounding half to even
+_FP_CONTEXT = decimal.Context(prec=16, rounding=decimal.ROUND_HALF_EVEN)
+_CT_CUTOFF = decimal.Decimal(35)
+_HIGH_MAX = decimal.Decimal(25)
+_MODERATE_MAX = decimal.Decimal(30)
+
+def evaluate(value_text):
+    """
+    Applies the result rules to one rendered \\ValSet value.
+    Returns (result, xa, tag), or None if the value isn't a plain number.
+    """
+    if not _NUMBER_PATTERN.match(value_text):
+        return None
+    value = _FP_CONTEXT.create_decimal(value_text)
+    if value == -1:
+        return NOT_TESTED, '', ''
+    if 0 < value < _CT_CUTOFF:
+        # Same digits as \fp_to_decimal:n: no exponent, no trailing zeros
+        xa = format(_FP_CONTEXT.subtract(_CT_CUTOFF, value).normalize(_FP_CONTEXT), 'f')
+        if value <= _HIGH_MAX:
+            tag = HIGH
+        elif value <= _MODERATE_MAX:
+            tag = MODERATE
+        else:
+            tag = LOW
+        return DETECTED, xa, tag
+    return NOT_DETECTED, '', ''
+
+def render_rules_column(key, values):
+    """
+    Renders the \\ValRules line for each rendered value of a lab result column
+    ('' where the value isn't a plain number). Repeated values are evaluated once.
+    """
+    rendered = []
+    memo = {}
+    for value_text in values:
+        line = memo.get(value_text)
+        if line is None:
+            rules = evaluate(value_text)
+            line = '' if rules is None else f"\\ValRules{{{key}}}{{{rules[0]}}}{{{rules[1]}}}{{{rules[2]}}}"
+            memo[value_text] = line
+        rendered.append(line)
+    return rendered
+
+# --- CROSS-CHECK AGAINST THE TEMPLATES ---
+# Typesets \ResultOf, \XAOf, \XATagOf and \DescOf for a range of values twice
+# per template, once from \ValSet alone (the template's LaTeX3 rules) and once
+# with \ValRules as well, and compares the two boxes with \showbox.
+CHECK_VALUES = [
+    '-1', '-1.0', '-2', '0', '0.0', '.5', '0.01', '1', '12.5', '+12', '24.99', '25', '25.00',
+    '25.01', '28.123456789012345', '29.999', '30', '30.0', '30.01', '34.99', '34.999999',
+    '35', '35.0', '35.01', '40', '45.5',
+]
+_DESC_NAME_PATTERN = re.compile(r"^\\DescSet\{([^}]+)\}", re.M)
+_VALUE_NAME_PATTERN = re.compile(r"\\(?:Val|ValGet|ResultOf|XAOf|XATagOf|DescOf|DescOfLactobacillusAdvanced|getLactobacillusStatus|getTestControlStatus)\{([^}#\\]+)\}")
+_CHECK_PATTERN = re.compile(r"^XGCHECK:(\d+):(old|new)$", re.M)
+
+def value_names(template_text):
+    """Every value name a template reads (\\Val{...}, \\ResultOf{...}, ...), as a set."""
+    return set(_VALUE_NAME_PATTERN.findall(template_text))
+
+def _check_document(template_path, cases):
+    """The template with a sample record, followed by one old/new box pair per case."""
+    # Imported here: report_compiler imports this module
+    import report_compiler
+
+    prefix, suffix = report_compiler.load_template(template_path)
+    end_at = suffix.rfind('\\end{document}')
+    names = sorted(value_names(prefix + suffix))
+    sample = '\n'.join(f"\\ValSet{{{name}}}{{20}}" for name in names)
+
+    probe = [
+        '\\clearpage\n\\showboxdepth=\\maxdimen \\showboxbreadth=\\maxdimen\n',
+        '\\newcommand{\\XGCheckRow}[1]{\\begin{tabular}{llll}\\ResultOf{#1}&\\XAOf{#1}&\\XATagOf{#1}&\\DescOf{#1}\\end{tabular}}\n',
+    ]
+    for n, (name, value_text) in enumerate(cases):
+        rules = evaluate(value_text)
+        rules_line = '' if rules is None else f"\\ValRules{{{name}}}{{{rules[0]}}}{{{rules[1]}}}{{{rules[2]}}}"
+        probe.append(
+            f"\\setbox0=\\hbox{{\\begingroup\\ValSet{{{name}}}{{{value_text}}}\\XGCheckRow{{{name}}}\\endgroup}}%\n"
+            f"\\setbox2=\\hbox{{\\begingroup\\ValSet{{{name}}}{{{value_text}}}{rules_line}\\XGCheckRow{{{name}}}\\endgroup}}%\n"
+            f"\\typeout{{XGCHECK:{n}:old}}\\showbox0\n"
+            f"\\typeout{{XGCHECK:{n}:new}}\\showbox2\n"
+        )
+    return prefix + sample + suffix[:end_at] + ''.join(probe) + suffix[end_at:]
+
+def _box_dumps(log_text):
+    """{(case, 'old'|'new'): box dump} from the \\showbox output in a log."""
+    dumps = {}
+    marks = list(_CHECK_PATTERN.finditer(log_text))
+    for i, mark in enumerate(marks):
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(log_text)
+        lines = []
+        for line in log_text[mark.end():end].splitlines():
+            if line.startswith('! OK'):
+                break
+            if line.startswith('> \\box'):
+                continue
+            lines.append(line)
+        dumps[(int(mark.group(1)), mark.group(2))] = '\n'.join(lines).strip()
+    return dumps
+
+def cross_check(template_path, output_folder=None):
+    """
+    Compiles the check document for one template.
+    Returns a list of (name, value, problem) mismatches (empty when they agree);
+    the check's .tex and .log are then kept in output_folder (config.OUTPUT_DIR).
+    """
+    import report_compiler
+
+    with open(template_path, 'r') as f:
+        desc_names = _DESC_NAME_PATTERN.findall(f.read())
+    # A pathogen with a description, and one without
+    names = desc_names[:1] + ['XG Check Pathogen']
+    cases = [(name, value_text) for name in names for value_text in CHECK_VALUES]
+
+    # One name per template, so the files kept for each failing template don't overwrite each other
+    jobname = f"rules_check_{report_compiler._sanitize_for_filename(os.path.splitext(os.path.basename(template_path))[0])}"
+    job_dir = report_compiler._scratch_dir()
+    tex_path = os.path.join(job_dir, f"{jobname}.tex")
+    with open(tex_path, 'w') as f:
+        f.write(_check_document(template_path, cases))
+    # \showbox counts as an error in nonstopmode, so the exit code is ignored
+    try:
+        subprocess.run(
+            ["pdflatex", "-interaction=nonstopmode", f"{jobname}.tex"],
+            cwd=job_dir, capture_output=True, text=True, errors='replace',
+            startupinfo=report_compiler._startupinfo(), timeout=config.COMPILE_TIMEOUT or None
+        )
+        with open(os.path.join(job_dir, f"{jobname}.log"), 'r', errors='replace') as f:
+            dumps = _box_dumps(f.read())
+    except (OSError, subprocess.TimeoutExpired):
+        dumps = {}
+
+    problems = []
+    for n, (name, value_text) in enumerate(cases):
+        old, new = dumps.get((n, 'old')), dumps.get((n, 'new'))
+        if old is None or new is None:
+            problems.append((name, value_text, 'not typeset'))
+        elif old != new:
+            problems.append((name, value_text, 'output differs'))
+    if problems:
+        log_path = report_compiler._keep_failure_files(job_dir, jobname, output_folder or config.OUTPUT_DIR)
+        print(f"  > See log file for details: {log_path}", file=sys.stderr)
+    return problems
+
+# --- RULES GATE ---
+# Before a run compiles with a template, cross_check() must have passed for it:
+# otherwise (failed, not checked yet, or the check couldn't run) its reports
+# are compiled without \ValRules, from the template's own LaTeX3 rules. Pass
+# and mismatch outcomes are kept in config.CACHE_DIR per template text, TeX
+# engine and version of these rules, so each template is checked once; a check
+# that couldn't typeset (no pdflatex, timeout) is tried again on the next run.
+_RULES_CHECK_FILE = 'rules_check.json'
+_checked = {}  # template_path -> (check key, passed)
+_checked_lock = threading.Lock()
+
+def _check_key(template_path):
+    import report_compiler
+
+    digest = hashlib.sha256()
+    with open(__file__, 'rb') as f:
+        digest.update(f.read())
+    digest.update(report_compiler.template_digest(template_path).encode())
+    digest.update(report_compiler._latex_engine_version().encode())
+    return digest.hexdigest()
+
+def _load_check_cache():
+    try:
+        with open(os.path.join(config.CACHE_DIR, _RULES_CHECK_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_check_cache(outcomes):
+    try:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        path = os.path.join(config.CACHE_DIR, _RULES_CHECK_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(outcomes, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"  > WARNING: Could not save the result rules check. {e}", file=sys.stderr)
+
+def check_templates(template_paths, output_folder=None):
+    """
+    Cross-checks the precomputed rules against each template not checked yet
+    (needs pdflatex). Templates that fail compile without \\ValRules.
+    """
+    if not (config.PRECOMPUTE_RULES and config.CHECK_PRECOMPUTED_RULES):
+        return
+    import report_compiler
+
+    outcomes = None
+    for template_path in sorted(set(template_paths)):
+        try:
+            key = _check_key(template_path)
+        except (OSError, report_compiler.TemplateError):
+            continue # The compile reports the template error
+        with _checked_lock:
+            if _checked.get(template_path, (None,))[0] == key:
+                continue
+        if outcomes is None:
+            outcomes = _load_check_cache()
+        passed = outcomes.get(key)
+        if passed is None:
+            print(f"  > Checking precomputed result rules against {os.path.basename(template_path)}")
+            problems = cross_check(template_path, output_folder)
+            passed = not problems
+            differences = [problem for problem in problems if problem[2] != 'not typeset']
+            if differences:
+                name, value_text, _ = differences[0]
+                print(f"  > WARNING: The precomputed result rules differ from {os.path.basename(template_path)} "
+                      f"({len(differences)} mismatches, e.g. {name} = {value_text}). "
+                      f"Its reports use the template's own rules.", file=sys.stderr)
+            elif problems:
+                print(f"  > WARNING: Could not check the precomputed result rules against {os.path.basename(template_path)} "
+                      f"(the check document was not typeset). Its reports use the template's own rules.", file=sys.stderr)
+                with _checked_lock:
+                    _checked.pop(template_path, None)
+                continue # Checked again next run
+            outcomes[key] = passed
+            _save_check_cache(outcomes)
+        with _checked_lock:
+            _checked[template_path] = (key, passed)
+
+def rules_verified(template_path):
+    """
+    True if the template passed its check (see check_templates()). Reports of
+    any other template are written without \\ValRules, unless
+    config.CHECK_PRECOMPUTED_RULES is off.
+    """
+    if not config.CHECK_PRECOMPUTED_RULES:
+        return True
+    with _checked_lock:
+        return _checked.get(template_path, (None, False))[1]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks that the Python result rules print the same as each template's LaTeX rules (needs pdflatex)."
+    )
+    parser.add_argument('templates', nargs='*', help="Template files (default: every template).")
+    args = parser.parse_args()
+    import report_compiler
+
+    template_paths = args.templates or sorted(glob.glob(os.path.join(config.TEMPLATE_DIR, '*.tex')))
+    failed = False
+    try:
+        for template_path in template_paths:
+            problems = cross_check(template_path)
+            if not problems:
+                print(f"  > OK: {os.path.basename(template_path)}")
+                continue
+            failed = True
+            print(f"  > ERROR: {os.path.basename(template_path)}: {len(problems)} mismatches", file=sys.stderr)
+            for name, value_text, problem in problems:
+                print(f"      {name} = {value_text}: {problem}", file=sys.stderr)
+    finally:
+        report_compiler.cleanup_scratch()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import config
+import build_manifest
+import pipeline
+import report_compiler
+
+# --- SHARDING ---
+# Splits one run across several machines. Each machine reads the same input
+# files and runs `main.py --shard K/N`, which compiles only the reports whose
+# Barcode + TestID hash to shard K (of N) into its own output tree,
+# OUTPUT_DIR/shard-K-of-N. The hash doesn't depend on the machine, the
+# Python version or the order of the rows, so the N shards are disjoint and
+# together cover every report.
+#
+# Each shard writes <name>.json (config.SHARD_SUMMARY_NAME) next to its
+# build manifest: every record of the run, and what happened to its own.
+# Afterwards
+#
+#     python sharding.py output/shard-1-of-4 output/shard-2-of-4 ...
+#
+# merges the shard summaries and build manifests and lists the records that
+# no shard produced.
+
+SUMMARY_VERSION = 1
+
+def parse_shard(text):
+    """'K/N' -> (K, N), with 1 <= K <= N. For argparse's type=."""
+    try:
+        shard, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N (e.g. 2/4), got '{text}'")
+    if count < 1 or not 1 <= shard <= count:
+        raise argparse.ArgumentTypeError(f"shard must be between 1/{count} and {count}/{count}, got '{text}'")
+    return shard, count
+
+def shard_of(barcode, test_id, count):
+    """The shard (1..count) a record belongs to."""
+    digest = hashlib.sha256(f"{barcode}\x1f{test_id}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+def shard_folder(shard, count, output_folder=None):
+    return os.path.join(output_folder or config.OUTPUT_DIR, f"shard-{shard}-of-{count}")
+
+class ShardSelector(object):
+    """
+    The select callback for pipeline.run_pipeline(): keeps the reports of
+    one shard and notes every record it was offered.
+    """
+    def __init__(self, shard, count):
+        self.shard = shard
+        self.count = count
+        self.records = []  # (report key, barcode, test id)
+
+    def __call__(self, job):
+        record_dict = job[0]
+        barcode, test_id = str(record_dict.get('Barcode', '')), str(record_dict.get('TestID', ''))
+        self.records.append((pipeline._job_key(job), barcode, test_id))
+        return shard_of(barcode, test_id, self.count) == self.shard
+
+def _records_digest(records):
+    """Same digest on every shard that read the same inputs."""
+    digest = hashlib.sha256()
+    for record in sorted(records):
+        digest.update('\x1f'.join(record).encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+def write_shard_summary(output_folder, selector, summary):
+    """
+    Writes the shard's summary after its run: all records, the status of its
+    own ('produced', or 'failed' with the reason) and the run's counts.
+    Returns the path.
+    """
+    manifest = build_manifest.BuildManifest(output_folder)
+    reports = {}
+    for report_key, barcode, test_id in selector.records:
+        if shard_of(barcode, test_id, selector.count) != selector.shard:
+            continue
+        reason = report_compiler.failure_reason(report_key)
+        if reason is None and report_key not in manifest.entries:
+            reason = 'No PDF recorded'
+        reports[report_key] = {'status': 'produced' if reason is None else 'failed', 'reason': reason}
+
+    failed_reports = sum(1 for status in reports.values() if status['status'] == 'failed')
+    shard_summary = {
+        'version': SUMMARY_VERSION,
+        'shard': selector.shard,
+        'count': selector.count,
+        'records_digest': _records_digest(selector.records),
+        'records': [list(record) for record in selector.records],
+        'reports': reports,
+        'success': summary.success,
+        'up_to_date': summary.up_to_date,
+        'failure': summary.failure,
+        # Patients the join skipped (missing results, unknown panel); every shard sees them
+        'skipped_patients': max(0, summary.failure - failed_reports),
+    }
+    path = os.path.join(output_folder, f"{config.SHARD_SUMMARY_NAME}.json")
+    os.makedirs(output_folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(shard_summary, f)
+    os.replace(tmp_path, path)
+    return path
+
+# --- MERGING ---
+
+def _load_shard(folder):
+    path = os.path.join(folder, f"{config.SHARD_SUMMARY_NAME}.json")
+    try:
+        with open(path, 'r') as f:
+            shard_summary = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  > ERROR: Could not read shard summary {path}. {e}", file=sys.stderr)
+        return None
+    if shard_summary.get('version') != SUMMARY_VERSION:
+        print(f"  > ERROR: {path} was written by another version of the report generator.", file=sys.stderr)
+        return None
+    return shard_summary
+
+def merge_shards(folders, output_folder):
+    """
+    Merges the shard summaries and build manifests in folders into
+    output_folder/<config.SHARD_MERGE_NAME>.json. Returns the list of records
+    no shard produced, as (report key, barcode, test id, why), or None if
+    the shards can't be merged.
+    """
+    shards = {}
+    for folder in folders:
+        shard_summary = _load_shard(folder)
+        if shard_summary is None:
+            continue
+        shard = shard_summary['shard']
+        if shard in shards:
+            print(f"  > ERROR: {folder} and {shards[shard][0]} are both shard {shard}.", file=sys.stderr)
+            return None
+        shards[shard] = (folder, shard_summary)
+    if not shards:
+        print("  > ERROR: No shard summaries to merge.", file=sys.stderr)
+        return None
+
+    counts = {shard_summary['count'] for _, shard_summary in shards.values()}
+    digests = {shard_summary['records_digest'] for _, shard_summary in shards.values()}
+    if len(counts) > 1:
+        print(f"  > ERROR: The shards were split different ways (N = {', '.join(map(str, sorted(counts)))}).", file=sys.stderr)
+        return None
+    if len(digests) > 1:
+        print("  > ERROR: The shards did not read the same input records; rerun them on the same files.", file=sys.stderr)
+        return None
+    count = counts.pop()
+    missing_shards = [shard for shard in range(1, count + 1) if shard not in shards]
+    for shard in missing_shards:
+        print(f"  > WARNING: No summary for shard {shard}/{count}; its reports count as not produced.", file=sys.stderr)
+
+    # Every shard lists every record; take them from any of them
+    records = next(iter(shards.values()))[1]['records']
+    merged_reports = {}
+    not_produced = []
+    for report_key, barcode, test_id in records:
+        shard = shard_of(barcode, test_id, count)
+        if shard not in shards:
+            not_produced.append((report_key, barcode, test_id, f"shard {shard}/{count} has no summary"))
+            continue
+        folder, shard_summary = shards[shard]
+        status = shard_summary['reports'].get(report_key)
+        if status is None or status['status'] != 'produced':
+            reason = status['reason'] if status else 'not in the shard summary'
+            not_produced.append((report_key, barcode, test_id, f"shard {shard}/{count}: {reason}"))
+            continue
+        merged_reports[report_key] = {'shard': shard, 'folder': os.path.abspath(folder)}
+
+    # Fold in each shard's build manifest entry for its reports
+    for shard, (folder, _) in shards.items():
+        manifest = build_manifest.BuildManifest(folder)
+        for report_key, build in manifest.entries.items():
+            if merged_reports.get(report_key, {}).get('shard') == shard:
+                merged_reports[report_key].update(build)
+
+    skipped_patients = max(shard_summary['skipped_patients'] for _, shard_summary in shards.values())
+    merged = {
+        'version': SUMMARY_VERSION,
+        'count': count,
+        'shards': {str(shard): os.path.abspath(folder) for shard, (folder, _) in sorted(shards.items())},
+        'missing_shards': missing_shards,
+        'records': len(records),
+        'produced': len(merged_reports),
+        'skipped_patients': skipped_patients,
+        'not_produced': [
+            {'report': report_key, 'Barcode': barcode, 'TestID': test_id, 'reason': why}
+            for report_key, barcode, test_id, why in not_produced
+        ],
+        'reports': merged_reports,
+    }
+    os.makedirs(output_folder, exist_ok=True)
+    path = os.path.join(output_folder, f"{config.SHARD_MERGE_NAME}.json")
+    with open(path, 'w') as f:
+        json.dump(merged, f, indent=1, sort_keys=True)
+
+    print("=============================================")
+    print("      Shard Merge Summary")
+    print(f"  Shards merged: {len(shards)} of {count}")
+    print(f"  Reports found to generate: {len(records)}")
+    print(f"  Produced: {len(merged_reports)} reports")
+    if skipped_patients:
+        print(f"  Patients skipped while matching results: {skipped_patients} (see the shard logs)")
+    if not_produced:
+        print(f"  Not produced by any shard: {len(not_produced)} reports")
+        for report_key, barcode, test_id, why in not_produced:
+            print(f"    {barcode} ({test_id}) {report_key}: {why}")
+    print(f"  Merged summary written to {path}")
+    print("=============================================")
+    return not_produced
+
+def main():
+    parser = argparse.ArgumentParser(description="Merges the summaries and build manifests of a sharded run (main.py --shard K/N).")
+    parser.add_argument('folders', nargs='+', help="The shards' output folders (e.g. output/shard-1-of-4).")
+    parser.add_argument('-o', '--output', default=config.OUTPUT_DIR,
+                        help="Folder for the merged summary (default: the output folder).")
+    args = parser.parse_args()
+    not_produced = merge_shards(args.folders, args.output)
+    sys.exit(0 if not_produced == [] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Checks the precomputed result rules (report_rules.py) against the templates'
+own LaTeX3 rules.
+
+    python -m pytest -q tests
+
+test_cross_check compiles report_rules.cross_check() for every template and
+needs pdflatex on the PATH (it is skipped without it). The other tests run
+anywhere.
+"""
+import glob
+import os
+import re
+import shutil
+import sys
+
+import pytest
+
+# Make the project modules importable when run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import report_compiler
+import report_rules
+
+TEMPLATES = sorted(glob.glob(os.path.join(config.TEMPLATE_DIR, '*.tex')))
+
+# What \ResultPretty, \XA and \XATagPretty print for each check value, worked
+# out from their l3fp comparisons: (result, XA, tag) as \ValRules codes.
+EXPECTED = {
+    '-1': ('T', '', ''), '-1.0': ('T', '', ''), '-2': ('N', '', ''),
+    '0': ('N', '', ''), '0.0': ('N', '', ''),
+    '.5': ('D', '34.5', 'H'), '0.01': ('D', '34.99', 'H'), '1': ('D', '34', 'H'),
+    '12.5': ('D', '22.5', 'H'), '+12': ('D', '23', 'H'), '24.99': ('D', '10.01', 'H'),
+    '25': ('D', '10', 'H'), '25.00': ('D', '10', 'H'),
+    '25.01': ('D', '9.99', 'M'), '28.123456789012345': ('D', '6.87654321098766', 'M'),
+    '29.999': ('D', '5.001', 'M'), '30': ('D', '5', 'M'), '30.0': ('D', '5', 'M'),
+    '30.01': ('D', '4.99', 'L'), '34.99': ('D', '0.01', 'L'), '34.999999': ('D', '0.000001', 'L'),
+    '35': ('N', '', ''), '35.0': ('N', '', ''), '35.01': ('N', '', ''),
+    '40': ('N', '', ''), '45.5': ('N', '', ''),
+}
+
+def test_expected_covers_check_values():
+    assert sorted(EXPECTED) == sorted(report_rules.CHECK_VALUES)
+
+@pytest.mark.parametrize('value_text', report_rules.CHECK_VALUES)
+def test_evaluate(value_text):
+    assert report_rules.evaluate(value_text) == EXPECTED[value_text]
+
+@pytest.mark.parametrize('value_text', ['Pending', '1e-05', '', 'N/A', '12,5', '\\textbf{12}'])
+def test_evaluate_leaves_other_values_to_the_template(value_text):
+    assert report_rules.evaluate(value_text) is None
+
+def test_render_rules_column():
+    lines = report_rules.render_rules_column('HSV-1', ['25.01', 'Pending', '-1', '25.01'])
+    assert lines == [
+        '\\ValRules{HSV-1}{D}{9.99}{M}',
+        '',
+        '\\ValRules{HSV-1}{T}{}{}',
+        '\\ValRules{HSV-1}{D}{9.99}{M}',
+    ]
+
+# --- Printed text of each code ---
+# \xgResD etc. must print what the matching branch of the template's
+# \ResultPretty / \XATagPretty prints. Compared as TeX reads them: in expl3
+# code spaces are ignored and ~ is a space; spaces after a control word are
+# skipped either way.
+
+def _strip_comments(text):
+    return re.sub(r"(?<!\\)%.*", '', text)
+
+def _tokens(text, expl):
+    """text as a list of TeX tokens (control sequences and characters)."""
+    letters = '[A-Za-z@_:]' if expl else '[A-Za-z@]'
+    tokens = []
+    for token in re.findall(rf"\\{letters}+|\\.|\s+|.", text):
+        if token.isspace() or (expl and token == '~'):
+            if expl and token.isspace():
+                continue # Ignored in expl3 code
+            if tokens and (tokens[-1] == ' ' or re.fullmatch(rf"\\{letters}+", tokens[-1])):
+                continue # One space, and none after a control word
+            token = ' '
+        tokens.append(token)
+    return tokens
+
+def _macro_body(source, name):
+    """Body of \\newcommand{\\<name>}{...}."""
+    start = source.index(f"\\newcommand{{\\{name}}}{{") + len(f"\\newcommand{{\\{name}}}{{")
+    depth = 1
+    for end in range(start, len(source)):
+        depth += {'{': 1, '}': -1}.get(source[end], 0)
+        if depth == 0:
+            return source[start:end]
+    raise ValueError(name)
+
+def _document_command(source, name):
+    """Text of \\NewDocumentCommand{\\<name>} up to the next command definition."""
+    start = source.index(f"\\NewDocumentCommand{{\\{name}}}")
+    end = re.compile(r"\\(?:NewDocumentCommand|newcommand)\{").search(source, start + 1)
+    return source[start:end.start() if end else len(source)]
+
+@pytest.mark.parametrize('template_path', TEMPLATES, ids=os.path.basename)
+def test_codes_print_the_template_texts(template_path):
+    with open(template_path, 'r') as f:
+        source = _strip_comments(f.read())
+    groups = {
+        'ResultPretty': ['xgResD', 'xgResN', 'xgResT'],
+        'XATagPretty': ['xgTagH', 'xgTagM', 'xgTagL'],
+    }
+    for command, macros in groups.items():
+        branches = '\x00'.join(_tokens(_document_command(source, command), expl=True))
+        for macro in macros:
+            text = _tokens(_macro_body(source, macro), expl=False)
+            assert '\x00'.join(['{'] + text + ['}']) in branches, \
+                f"\\{macro} prints '{''.join(text)}', not a branch of \\{command}"
+
+# --- Rules gate ---
+
+@pytest.fixture
+def gate(tmp_path, monkeypatch):
+    """check_templates() with an empty cache and cross_check() replaced by the returned outcomes."""
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'PRECOMPUTE_RULES', True)
+    monkeypatch.setattr(config, 'CHECK_PRECOMPUTED_RULES', True)
+    monkeypatch.setattr(report_rules, '_checked', {})
+    outcomes = {}
+    monkeypatch.setattr(report_rules, 'cross_check', lambda template_path, output_folder=None: outcomes[template_path])
+    return outcomes
+
+def test_gate_unchecked_template_has_no_rules(gate):
+    assert not report_rules.rules_verified(TEMPLATES[0])
+
+def test_gate_caches_pass_and_mismatch(gate):
+    passing, failing = TEMPLATES[:2]
+    gate[passing] = []
+    gate[failing] = [('HSV-1', '30', 'output differs')]
+    report_rules.check_templates([passing, failing])
+    assert report_rules.rules_verified(passing)
+    assert not report_rules.rules_verified(failing)
+
+    # A new process reads both outcomes from the cache, without checking again
+    gate.clear()
+    report_rules._checked.clear()
+    report_rules.check_templates([passing, failing])
+    assert report_rules.rules_verified(passing)
+    assert not report_rules.rules_verified(failing)
+
+def test_gate_checks_again_when_not_typeset(gate):
+    template_path = TEMPLATES[0]
+    gate[template_path] = [('HSV-1', value_text, 'not typeset') for value_text in report_rules.CHECK_VALUES]
+    report_rules.check_templates([template_path])
+    assert not report_rules.rules_verified(template_path)
+
+    gate[template_path] = []
+    report_rules.check_templates([template_path])
+    assert report_rules.rules_verified(template_path)
+
+# --- Against pdflatex ---
+
+@pytest.mark.skipif(shutil.which('pdflatex') is None, reason="needs pdflatex")
+@pytest.mark.parametrize('template_path', TEMPLATES, ids=os.path.basename)
+def test_cross_check(template_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SCRATCH_DIR', str(tmp_path / 'scratch'))
+    try:
+        assert report_rules.cross_check(template_path, str(tmp_path)) == []
+    finally:
+        report_compiler.cleanup_scratch()
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import threading
+
+# --- SPAN TRACING ---
+# Times the stages of a run (Excel parsing, joining, rendering, each pdflatex
+# run, publishing, ...) as spans:
+#
+#     with tracing.span('pdflatex', template=template_path):
+#         ...
+#
+# Tracing is off unless start() was called (main.py --profile, the GUI's
+# "Profile Run"). While it is off, span() returns one shared context manager
+# that does nothing. stop() writes the spans as a Chrome trace (open it in
+# chrome://tracing or https://ui.perfetto.dev) and returns a per-stage,
+# per-template and per-sheet breakdown.
+
+_spans = None  # (name, category, start, duration, thread id, args) while tracing
+_thread_names = {}
+_started_at = 0.0
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+class _Span(object):
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        spans = _spans
+        if spans is not None:
+            thread = threading.current_thread()
+            _thread_names[thread.ident] = thread.name
+            spans.append((self.name, self.category, self.start, duration, thread.ident, self.args))
+        return False
+
+def span(name, category='run', **args):
+    """Context manager timing one span. args (e.g. template, sheet, report) are kept with it."""
+    if _spans is None:
+        return _NO_SPAN
+    return _Span(name, category, args)
+
+def enabled():
+    return _spans is not None
+
+def start():
+    """Starts recording spans."""
+    global _spans, _started_at
+    _thread_names.clear()
+    _started_at = time.perf_counter()
+    _spans = []
+
+def collect():
+    """Stops recording and returns the spans: (name, category, start, duration, thread id, args)."""
+    global _spans
+    spans, _spans = _spans or [], None
+    return spans
+
+def stop(trace_path):
+    """
+    Stops recording, writes the spans to trace_path as a Chrome trace and
+    returns the breakdown lines for the run summary.
+    """
+    spans = collect()
+    write_chrome_trace(spans, trace_path)
+    return breakdown(spans)
+
+def write_chrome_trace(spans, trace_path):
+    """Writes spans (from collect()) as a Chrome trace JSON file."""
+    pid = os.getpid()
+    events = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+        for tid, name in _thread_names.items()
+    ]
+    for name, category, started, duration, tid, args in spans:
+        events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': round((started - _started_at) * 1e6, 1), 'dur': round(duration * 1e6, 1),
+            'args': {key: _json_value(value) for key, value in args.items()},
+        })
+    os.makedirs(os.path.dirname(trace_path) or '.', exist_ok=True)
+    with open(trace_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def stage_totals(spans):
+    """{span name: (count, total seconds)}"""
+    totals = {}
+    for name, _, _, duration, _, _ in spans:
+        count, total = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, total + duration)
+    return totals
+
+def _json_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def breakdown(spans):
+    """Summary lines: time per stage, then per template and per result sheet."""
+    if not spans:
+        return []
+    lines = ["  Time per stage (spans, total, mean):"]
+    for name, (count, total) in sorted(stage_totals(spans).items(), key=lambda item: -item[1][1]):
+        lines.append(f"    {name}: {count}, {total:.2f}s, {1000 * total / count:.1f}ms")
+
+    for arg, title in (('template', 'template'), ('sheet', 'result sheet')):
+        totals = {}
+        for name, _, _, duration, _, args in spans:
+            if arg in args:
+                key = os.path.splitext(os.path.basename(str(args[arg])))[0]
+                by_stage = totals.setdefault(key, {})
+                by_stage[name] = by_stage.get(name, 0.0) + duration
+        if not totals:
+            continue
+        lines.append(f"  Time per {title}:")
+        for key, by_stage in sorted(totals.items()):
+            stages = sorted(by_stage.items(), key=lambda item: -item[1])
+            lines.append(f"    {key}: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stages))
+    return lines
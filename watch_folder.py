@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from datetime import datetime
+import config
+import main as cli
+import pipeline
+import report_compiler
+
+# --- WATCH FOLDER ---
+# A long-running, headless report generator. Operators drop a pair of files
+# into the inbox:
+#
+#   <name>_demographics.xlsx   +   <name>_results.xlsx
+#
+# and each pair is processed, once both files have stopped changing, through
+# the same pipeline as main.py. The process stays up between drops, so the
+# imports, parsed templates, precompiled formats and .aux seeds stay warm.
+#
+#   <inbox>/processing/<name>/   the drop being processed
+#   <inbox>/done/<name>-<time>/  processed drops, with summary.json
+#   <inbox>/failed/<name>-<time>/  drops that couldn't be loaded or had failed reports
+#   <inbox>/reported_barcodes.jsonl  barcodes already reported; later drops skip them
+
+DEMOGRAPHICS_SUFFIX = '_demographics.xlsx'
+RESULTS_SUFFIX = '_results.xlsx'
+LEDGER_NAME = 'reported_barcodes.jsonl'
+
+class WatchFolder(object):
+    """Finds finished drops in the inbox and runs them through the pipeline."""
+    def __init__(self, inbox, output_folder=None, jobs=None, batch_size=None, archive_folder=None):
+        self.inbox = inbox
+        self.output_folder = output_folder or config.OUTPUT_DIR
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.archive_folder = archive_folder
+        self.ledger_path = os.path.join(inbox, LEDGER_NAME)
+        self.reported = self._load_ledger()
+        self._seen = {}  # input path -> (size, mtime_ns) at the last poll
+
+    def _load_ledger(self):
+        reported = set()
+        try:
+            with open(self.ledger_path, 'r') as f:
+                for line in f:
+                    try:
+                        reported.add(json.loads(line)['barcode'])
+                    except (ValueError, KeyError):
+                        continue # Line cut short by a crash
+        except FileNotFoundError:
+            pass
+        return reported
+
+    def warm_up(self):
+        """Parses every template and builds its precompiled format before the first drop."""
+        for template_path in sorted(glob.glob(os.path.join(config.TEMPLATE_DIR, '*.tex'))):
+            try:
+                report_compiler.load_template(template_path)
+                report_compiler._template_format(template_path)
+            except report_compiler.TemplateError as e:
+                print(f"  > WARNING: {e}", file=sys.stderr)
+
+    def ready_drops(self):
+        """Names of the drops whose two files are both present and have stopped changing."""
+        ready = []
+        now = time.time()
+        seen = {}
+        for demographics_path in sorted(glob.glob(os.path.join(self.inbox, f"*{DEMOGRAPHICS_SUFFIX}"))):
+            name = os.path.basename(demographics_path)[:-len(DEMOGRAPHICS_SUFFIX)]
+            paths = [demographics_path, os.path.join(self.inbox, f"{name}{RESULTS_SUFFIX}")]
+            try:
+                stats = [os.stat(path) for path in paths]
+            except OSError:
+                continue # Results file not there (yet)
+            settled = True
+            for path, stat in zip(paths, stats):
+                seen[path] = (stat.st_size, stat.st_mtime_ns)
+                if self._seen.get(path) != seen[path] or now - stat.st_mtime < config.WATCH_SETTLE_SECONDS:
+                    settled = False
+            if settled:
+                ready.append(name)
+        self._seen = seen
+        return ready
+
+    def process(self, name):
+        """Runs one drop through the pipeline and files it under done/ or failed/."""
+        print(f"\n--- New drop: {name} ---")
+        drop_dir = os.path.join(self.inbox, 'processing', name)
+        os.makedirs(drop_dir, exist_ok=True)
+        demographics_path = os.path.join(drop_dir, f"{name}{DEMOGRAPHICS_SUFFIX}")
+        results_path = os.path.join(drop_dir, f"{name}{RESULTS_SUFFIX}")
+        os.replace(os.path.join(self.inbox, f"{name}{DEMOGRAPHICS_SUFFIX}"), demographics_path)
+        os.replace(os.path.join(self.inbox, f"{name}{RESULTS_SUFFIX}"), results_path)
+
+        selected = []
+        def select(job):
+            if str(job[0].get('Barcode')) in self.reported:
+                return False
+            selected.append(job)
+            return True
+
+        started = datetime.now()
+        report = {'drop': name, 'started': started.isoformat(timespec='seconds')}
+        try:
+            summary = pipeline.run_pipeline(
+                demographics_path, results_path,
+                output_folder=self.output_folder,
+                use_cache=False, # Every drop is a new file
+                jobs=self.jobs,
+                batch_size=self.batch_size,
+                archive_folder=self.archive_folder,
+                separator="-" * 45,
+                select=select,
+            )
+        except Exception as e:
+            print(f"  > ERROR: Unexpected failure while processing {name}. {e}", file=sys.stderr)
+            summary = None
+            report['error'] = str(e)
+
+        if summary is not None:
+            newly_reported = self._record_reported(name, selected)
+            report.update({
+                'total': summary.total,
+                'success': summary.success,
+                'failure': summary.failure,
+                'already_reported': summary.left_out,
+                'newly_reported_barcodes': len(newly_reported),
+                'failures': [line.strip() for line in report_compiler.failure_summary()],
+            })
+        elif 'error' not in report:
+            report['error'] = 'Failed to load the input files'
+        report['finished'] = datetime.now().isoformat(timespec='seconds')
+
+        with open(os.path.join(drop_dir, 'summary.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        outcome = 'done' if summary is not None and summary.failure == 0 else 'failed'
+        destination = os.path.join(self.inbox, outcome, f"{name}-{started.strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(drop_dir, destination)
+
+        if summary is None:
+            print(f"  > ERROR: Drop {name} failed; moved to {destination}", file=sys.stderr)
+        else:
+            print(f"INFO: Drop {name}: {summary.success} reports generated, {summary.failure} failed, "
+                  f"{summary.left_out} already reported. Moved to {destination}")
+        sys.stdout.flush() # Keep a redirected log current between drops
+
+    def _record_reported(self, drop_name, jobs):
+        """Adds the barcodes whose every report was generated to the ledger. Returns them."""
+        failed = set()
+        barcodes = []
+        for job in jobs:
+            barcode = str(job[0].get('Barcode'))
+            if barcode not in barcodes:
+                barcodes.append(barcode)
+            if report_compiler.failure_reason(pipeline._job_key(job)) is not None:
+                failed.add(barcode)
+        newly_reported = [barcode for barcode in barcodes if barcode not in failed and barcode not in self.reported]
+        if newly_reported:
+            with open(self.ledger_path, 'a') as f:
+                for barcode in newly_reported:
+                    f.write(json.dumps({'barcode': barcode, 'drop': drop_name}) + '\n')
+            self.reported.update(newly_reported)
+        return newly_reported
+
+    def run(self, interval=None):
+        """Polls the inbox until interrupted (Ctrl+C)."""
+        interval = interval or config.WATCH_INTERVAL
+        print(f"INFO: Watching {self.inbox} for *{DEMOGRAPHICS_SUFFIX} + *{RESULTS_SUFFIX} pairs (Ctrl+C to stop).")
+        while True:
+            for name in self.ready_drops():
+                try:
+                    self.process(name)
+                except OSError as e:
+                    print(f"  > ERROR: Could not process drop {name}. {e}", file=sys.stderr)
+            time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Watches an inbox folder and generates the reports for each new drop.")
+    parser.add_argument('inbox', help="Folder to watch for <name>_demographics.xlsx + <name>_results.xlsx pairs.")
+    parser.add_argument('-o', '--output', default=None, help="Output folder (default: config.OUTPUT_DIR).")
+    parser.add_argument('-j', '--jobs', type=cli.positive_int, default=None, help="Number of reports to compile in parallel.")
+    parser.add_argument('-b', '--batch-size', type=int, default=None, help="Reports per pdflatex job.")
+    parser.add_argument('--archive', default=None, help="Folder to copy each finished report PDF to.")
+    parser.add_argument('--interval', type=float, default=None,
+                        help=f"Seconds between inbox checks (default: {config.WATCH_INTERVAL}).")
+    args = parser.parse_args()
+
+    os.makedirs(args.inbox, exist_ok=True)
+    watcher = WatchFolder(args.inbox, args.output, args.jobs, args.batch_size, args.archive)
+    print("INFO: Loading templates and precompiled formats...")
+    watcher.warm_up()
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        print("\nINFO: Stopped watching.")
+    finally:
+        report_compiler.cleanup_scratch()
+
+if __name__ == '__main__':
+    main()